@@ -0,0 +1,93 @@
+"""Compare the row encoder with sanitizing posts and writing them with csv.DictWriter.
+
+Run from the repository root: `python bench/encode_rows.py`
+"""
+import copy
+import csv
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scrape_social import REDDIT, RowEncoder, sanitize
+
+NUM_PAGES = 20
+PAGE_SIZE = 500
+REPEAT = 5
+
+def make_post(fieldnames, i):
+	words = ['GME', 'to', 'the', 'moon', 'calls|puts', 'hold  the  line', '\n', 'tendies']
+	post = {}
+	for field in fieldnames:
+		r = random.random()
+		if field == 'created_utc':
+			post[field] = 1600000000 + i
+		elif field == 'id':
+			post[field] = 'id{}'.format(i)
+		elif field in ('body', 'selftext', 'title'):
+			post[field] = ' '.join(random.choice(words) for _ in range(random.randint(5, 60)))
+		elif r < 0.3:
+			post[field] = None
+		elif r < 0.5:
+			post[field] = random.randint(0, 10000)
+		elif r < 0.6:
+			post[field] = random.random() < 0.5
+		elif r < 0.75:
+			post[field] = [{'e': 'text', 't': random.choice(words)}]
+		elif r < 0.8:
+			post[field] = {}
+		else:
+			post[field] = random.choice(words)
+	return post
+
+def legacy_write(f, data, fieldnames, delimiter='|'):
+	for i in range(len(data)):
+		for k in data[i]:
+			if isinstance(data[i][k], str):
+				data[i][k] = sanitize(data[i][k], delimiter)
+			else:
+				dump = json.dumps(data[i][k])
+				data[i][k] = json.loads(sanitize(dump, delimiter))
+	dw = csv.DictWriter(f, delimiter=delimiter, extrasaction='ignore', fieldnames=fieldnames)
+	for datum in data:
+		dw.writerow(datum)
+
+def encoder_write(f, data, fieldnames, delimiter='|'):
+	writer = csv.writer(f, delimiter=delimiter)
+	writer.writerows(RowEncoder(fieldnames, delimiter).encode(data))
+
+def run(write, pages, fieldnames):
+	best = None
+	output = None
+	for _ in range(REPEAT):
+		# Legacy path sanitizes posts in place
+		pages_copy = copy.deepcopy(pages)
+		f = io.StringIO()
+		start = time.perf_counter()
+		for page in pages_copy:
+			write(f, page, fieldnames)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+		output = f.getvalue()
+	return best, output
+
+if __name__ == '__main__':
+	random.seed(0)
+	with tempfile.TemporaryDirectory() as directory:
+		reddit = REDDIT(directory, 'wallstreetbets')
+		for post_type in ['submission', 'comment']:
+			fieldnames = reddit.get_fieldnames(post_type)
+			pages = [[make_post(fieldnames, p * PAGE_SIZE + i) for i in range(PAGE_SIZE)] for p in range(NUM_PAGES)]
+			legacy_time, legacy_output = run(legacy_write, pages, fieldnames)
+			encoder_time, encoder_output = run(encoder_write, pages, fieldnames)
+			print('{}: {} posts, DictWriter {:.3f}s, RowEncoder {:.3f}s, {:.1f}x, same output: {}'.format(
+				post_type,
+				NUM_PAGES * PAGE_SIZE,
+				legacy_time,
+				encoder_time,
+				legacy_time / encoder_time,
+				legacy_output == encoder_output))
@@ -0,0 +1,208 @@
+"""Local stand-in for the Pushshift Reddit search API over a synthetic corpus.
+
+Serves /reddit/search/{submission,comment} with `q`, `ids`, `link_id`,
+`after`, `before`, `size`, `sort` and `fields`, with configurable
+latency and error rate.
+/stats returns the number of requests served by status.
+
+Run on its own: `python bench/pushshift_server.py --port 8765`
+"""
+import argparse
+import bisect
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+WORDS = ['the', 'to', 'moon', 'calls', 'puts', 'hold', 'buy', 'sell', 'dip', 'tendies', 'yolo', 'earnings',
+	'short', 'squeeze', 'bag', 'holder', 'diamond', 'hands', 'apes', 'together', 'strong', 'loss', 'gain']
+MAX_SIZE = 500
+
+
+def make_symbols(n, seed=0):
+	"""Get n synthetic symbol table rows.
+	"""
+	rng = random.Random(seed)
+	symbols = []
+	seen = set()
+	while len(symbols) < n:
+		symbol = ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(rng.randint(2, 4)))
+		if symbol in seen:
+			continue
+		seen.add(symbol)
+		name = '{} {}'.format(symbol.capitalize(), rng.choice(['Industries', 'Holdings', 'Systems', 'Therapeutics']))
+		symbols.append({'symbol': symbol, 'shortName': name, 'longName': '{} Inc.'.format(name)})
+	return symbols
+
+def make_text(rng, symbols, mention_rate):
+	words = [rng.choice(WORDS) for _ in range(rng.randint(5, 40))]
+	if rng.random() < mention_rate:
+		symbol = rng.choice(symbols)
+		mention = rng.choice(['${}'.format(symbol['symbol']), symbol['symbol'], symbol['shortName']])
+		words.insert(rng.randint(0, len(words)), mention)
+	return ' '.join(words)
+
+def make_corpus(symbols, num_submissions=20000, num_comments=60000, start=1600000000, span=90 * 86400,
+		mention_rate=0.5, seed=0):
+	"""Get submissions and comments sorted by created_utc, mentioning random symbols.
+	"""
+	rng = random.Random(seed)
+	corpus = {'submission': [], 'comment': []}
+	for i in range(num_submissions):
+		corpus['submission'].append({
+			'created_utc': start + rng.randrange(span),
+			'id': 's{:x}'.format(i),
+			'author': 'user{}'.format(rng.randrange(1000)),
+			'title': make_text(rng, symbols, mention_rate),
+			'selftext': make_text(rng, symbols, mention_rate / 2),
+			'score': rng.randrange(1000),
+			'num_comments': rng.randrange(200),
+			'all_awardings': [],
+			'subreddit': 'wallstreetbets',
+		})
+	for i in range(num_comments):
+		corpus['comment'].append({
+			'created_utc': start + rng.randrange(span),
+			'id': 'c{:x}'.format(i),
+			'author': 'user{}'.format(rng.randrange(1000)),
+			'body': make_text(rng, symbols, mention_rate),
+			'score': rng.randrange(100),
+			'link_id': 't3_s{:x}'.format(rng.randrange(max(num_submissions, 1))),
+			'parent_id': 't3_s{:x}'.format(rng.randrange(max(num_submissions, 1))),
+			'subreddit': 'wallstreetbets',
+		})
+	for post_type in corpus:
+		corpus[post_type].sort(key=lambda post: (post['created_utc'], post['id']))
+		for post in corpus[post_type]:
+			text = ' '.join(str(post.get(attr, '')) for attr in ['title', 'selftext', 'body'])
+			post['_text'] = text.lower()
+	return corpus
+
+class PushshiftServer:
+	"""Threaded HTTP server answering Pushshift searches over a corpus.
+	"""
+	def __init__(self, corpus, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, seed=0):
+		self.corpus = corpus
+		self.latency = latency
+		self.error_rate = error_rate
+		self.stats = {}
+		self._times = {post_type: [post['created_utc'] for post in posts] for post_type, posts in corpus.items()}
+		self._ids = {post_type: {post['id']: post for post in posts} for post_type, posts in corpus.items()}
+		self._rng = random.Random(seed)
+		self._lock = threading.Lock()
+		self._server = ThreadingHTTPServer((host, port), self._get_handler())
+		self._server.daemon_threads = True
+		self._thread = None
+
+	@property
+	def url(self):
+		host, port = self._server.server_address[:2]
+		return 'http://{}:{}/reddit/search/{{}}'.format(host, port)
+
+	def start(self):
+		self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._server.shutdown()
+		self._server.server_close()
+
+	def _count(self, status):
+		with self._lock:
+			self.stats[status] = self.stats.get(status, 0) + 1
+
+	def search(self, post_type, params):
+		"""Get the response body of a search.
+		"""
+		posts = self.corpus[post_type]
+		times = self._times[post_type]
+		lo = 0
+		hi = len(posts)
+		if 'after' in params:
+			lo = bisect.bisect_right(times, int(float(params['after'])))
+		if 'before' in params:
+			hi = bisect.bisect_left(times, int(float(params['before'])))
+		size = min(int(params.get('size', 25)), MAX_SIZE)
+		terms = [term.strip('"').lower() for term in params.get('q', '').split('|') if term]
+		terms = [term[1:] if term.startswith('$') else term for term in terms]
+		link_ids = set(params['link_id'].split(',')) if 'link_id' in params else None
+		indices = range(lo, hi) if params.get('sort', 'desc') == 'asc' else range(hi - 1, lo - 1, -1)
+
+		data = []
+		if 'ids' in params:
+			by_id = self._ids[post_type]
+			data = [by_id[i] for i in params['ids'].split(',') if i in by_id][:size]
+			indices = []
+		for i in indices:
+			post = posts[i]
+			if link_ids is not None and post.get('link_id') not in link_ids:
+				continue
+			if len(terms) == 0 or any(term in post['_text'] for term in terms):
+				data.append(post)
+				if len(data) >= size:
+					break
+
+		fields = params.get('fields')
+		if fields is not None:
+			fields = fields.split(',')
+			data = [{k: post[k] for k in fields if k in post} for post in data]
+		else:
+			data = [{k: v for k, v in post.items() if k != '_text'} for post in data]
+		return json.dumps({'data': data}).encode('utf-8')
+
+	def _get_handler(self):
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				url = urlparse(self.path)
+				params = {k: v[0] for k, v in parse_qs(url.query).items()}
+				if server.latency > 0:
+					time.sleep(server._rng.expovariate(1 / server.latency))
+
+				if url.path == '/stats':
+					body = json.dumps(server.stats).encode('utf-8')
+					status = 200
+				else:
+					post_type = url.path.rsplit('/', 1)[-1]
+					if post_type not in server.corpus:
+						status, body = 404, b'{}'
+					elif server._rng.random() < server.error_rate:
+						status, body = server._rng.choice([429, 500, 502, 522]), b'{}'
+					else:
+						status, body = 200, server.search(post_type, params)
+					server._count(status)
+
+				self.send_response(status)
+				self.send_header('Content-Type', 'application/json')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				pass
+
+		return Handler
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--port', type=int, default=8765)
+	parser.add_argument('--symbols', type=int, default=200)
+	parser.add_argument('--submissions', type=int, default=20000)
+	parser.add_argument('--comments', type=int, default=60000)
+	parser.add_argument('--latency', type=float, default=0.0, help='mean seconds per response')
+	parser.add_argument('--error-rate', type=float, default=0.0)
+	args = parser.parse_args()
+
+	corpus = make_corpus(make_symbols(args.symbols), args.submissions, args.comments)
+	server = PushshiftServer(corpus, port=args.port, latency=args.latency, error_rate=args.error_rate)
+	print('Serving {}'.format(server.url))
+	server.start()
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		server.stop()
@@ -0,0 +1,166 @@
+"""End-to-end Reddit benchmark against a local Pushshift stand-in.
+
+Starts bench/pushshift_server.py in a separate process, so CPU time and
+peak RSS are the crawler's own, then runs one update mode over a
+synthetic symbol table in a temporary directory.
+
+Run from the repository root, e.g.
+`python bench/reddit_crawl.py --mode update --workers 16 --latency 0.05 --error-rate 0.02`
+"""
+import argparse
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import urllib.request
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from pushshift_server import PushshiftServer, make_corpus, make_symbols
+
+MODES = ['update', 'async', 'split', 'crawl', 'download', 'refresh', 'threads']
+
+
+def serve(args, symbols, conn):
+	corpus = make_corpus(symbols, args.submissions, args.comments)
+	server = PushshiftServer(corpus, latency=args.latency, error_rate=args.error_rate).start()
+	conn.send(server.url)
+	conn.recv()
+	server.stop()
+
+def read_symbols(filename):
+	with open(filename, 'r', encoding='utf-8') as f:
+		return [row for row in csv.DictReader(f, delimiter='|')]
+
+def write_symbols(filename, symbols):
+	os.makedirs(os.path.dirname(filename), exist_ok=True)
+	with open(filename, 'w', encoding='utf-8') as f:
+		writer = csv.DictWriter(f, delimiter='|', fieldnames=['symbol', 'shortName', 'longName'], extrasaction='ignore')
+		writer.writeheader()
+		writer.writerows(symbols)
+
+def get_server_stats(url):
+	stats_url = url.split('/reddit/')[0] + '/stats'
+	with urllib.request.urlopen(stats_url) as res:
+		return json.loads(res.read())
+
+def run(args, url):
+	import scrape_social as ss
+	from ratelimit import RateGovernor
+	from tor_pool import TorPool
+
+	ss.NUM_WORKERS = args.workers
+	ss.tor = TorPool(args.workers, host=None, control_port=None)
+	ss.governor = RateGovernor(rate=args.rate, max_rate=max(args.rate, 64), burst=max(args.rate, 8))
+	reddit = ss.REDDIT('reddit_data', 'wallstreetbets', storage=args.storage, profile=args.profile)
+	reddit.url = url
+	# Compile queries before timing
+	reddit.get_query_table()
+	output = sys.stdout if args.verbose else open(os.devnull, 'w')
+	if args.mode in ['refresh', 'threads']:
+		# Time a pass over the posts saved by an update
+		with contextlib.redirect_stdout(output):
+			reddit.update()
+	counters_before = ss.metrics.snapshot()['counters']
+	stats_before = get_server_stats(url)
+
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	start = time.perf_counter()
+	with contextlib.redirect_stdout(output):
+		if args.mode == 'update':
+			reddit.update()
+		elif args.mode == 'async':
+			reddit.update_async(concurrency=args.workers)
+		elif args.mode == 'split':
+			reddit.update_windows()
+		elif args.mode == 'crawl':
+			reddit.update_crawl()
+		elif args.mode == 'download':
+			for symbol in ss.get_symbols()[:args.download_symbols]:
+				for post_type in ['submission', 'comment']:
+					reddit.download_data(symbol, post_type)
+			reddit.close()
+		elif args.mode == 'refresh':
+			reddit.update_refresh()
+		elif args.mode == 'threads':
+			reddit.update_threads(concurrency=args.workers)
+	elapsed = time.perf_counter() - start
+	end_usage = resource.getrusage(resource.RUSAGE_SELF)
+
+	counters = {k: v - counters_before.get(k, 0) for k, v in ss.metrics.snapshot()['counters'].items()}
+	posts_name = 'refreshed_total' if args.mode == 'refresh' else 'posts_total'
+	posts = sum(v for k, v in counters.items() if k.startswith(posts_name))
+	nbytes = sum(v for k, v in counters.items() if k.startswith('bytes_total'))
+	cpu_user = end_usage.ru_utime - usage.ru_utime
+	cpu_sys = end_usage.ru_stime - usage.ru_stime
+	return {
+		'mode': args.mode,
+		'stats_before': stats_before,
+		'profile': args.profile,
+		'workers': args.workers,
+		'seconds': elapsed,
+		'posts': posts,
+		'bytes': nbytes,
+		'posts_per_sec': posts / elapsed,
+		'cpu_user': cpu_user,
+		'cpu_sys': cpu_sys,
+		'cpu_util': (cpu_user + cpu_sys) / elapsed,
+		# Kilobytes on Linux
+		'peak_rss_mb': end_usage.ru_maxrss / 1024,
+		'tor_renewals': ss.tor.renewals,
+	}
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--mode', choices=MODES, default='update')
+	parser.add_argument('--workers', type=int, default=16)
+	parser.add_argument('--storage', choices=['csv', 'parquet', 'store'], default='csv')
+	parser.add_argument('--profile', choices=['full', 'minimal'], default='full', help='fields requested from the server')
+	parser.add_argument('--symbols', type=int, default=100, help='number of synthetic symbols')
+	parser.add_argument('--symbol-table', help='symbol table csv to use instead of synthetic symbols')
+	parser.add_argument('--submissions', type=int, default=20000)
+	parser.add_argument('--comments', type=int, default=60000)
+	parser.add_argument('--latency', type=float, default=0.0, help='mean seconds per response')
+	parser.add_argument('--error-rate', type=float, default=0.0)
+	parser.add_argument('--rate', type=float, default=10000.0, help='initial requests/sec of the rate governor')
+	parser.add_argument('--download-symbols', type=int, default=5, help='symbols of download mode')
+	parser.add_argument('--verbose', action='store_true')
+	args = parser.parse_args()
+
+	if args.symbol_table:
+		symbols = read_symbols(args.symbol_table)
+	else:
+		symbols = make_symbols(args.symbols)
+
+	parent_conn, child_conn = multiprocessing.Pipe()
+	server = multiprocessing.Process(target=serve, args=(args, symbols, child_conn), daemon=True)
+	server.start()
+	url = parent_conn.recv()
+
+	with tempfile.TemporaryDirectory() as directory:
+		os.chdir(directory)
+		write_symbols(os.path.join('symbol_data', 'symbol_table.csv'), symbols)
+		try:
+			result = run(args, url)
+			stats = get_server_stats(url)
+		finally:
+			parent_conn.send('stop')
+			server.join(10)
+			os.chdir(REPO_DIR)
+
+	stats = {k: v - result['stats_before'].get(k, 0) for k, v in stats.items()}
+	requests = sum(stats.values())
+	errors = sum(v for k, v in stats.items() if k != '200')
+	result['requests'] = requests
+	result['requests_per_sec'] = requests / result['seconds']
+	result['errors'] = errors
+	print('{mode} ({profile} fields) with {workers} workers: {seconds:.2f}s, {posts} posts ({posts_per_sec:.0f}/s), '
+		'{requests} requests ({requests_per_sec:.1f}/s, {errors} errors), '
+		'cpu {cpu_user:.2f}s user {cpu_sys:.2f}s sys ({cpu_util:.0%}), peak rss {peak_rss_mb:.0f} MB, '
+		'{tor_renewals} circuit renewals'.format(**result))
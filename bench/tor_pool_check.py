@@ -0,0 +1,216 @@
+"""Check tor_pool against a local SOCKS5 stand-in for tor.
+
+The stand-in accepts any username and password, records the credentials
+of each connection and relays it to a local HTTP server. Credentials it
+is told to block are refused, like a circuit whose exit is blocked.
+Checks that circuits keep distinct credentials, that failed circuits
+are replaced in both engines and that NEWNYM is throttled.
+
+Run from the repository root: `python bench/tor_pool_check.py`
+"""
+import asyncio
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+from aiohttp_socks import ProxyError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tor_pool import AsyncCircuit, TorPool
+
+
+class SocksStandIn:
+	"""Threaded SOCKS5 server with username/password auth relaying to any host.
+	"""
+	def __init__(self, host='127.0.0.1', port=0):
+		self.usernames = []
+		self.blocked = set()
+		self._lock = threading.Lock()
+		self._server = socketserver.ThreadingTCPServer((host, port), self._get_handler())
+		self._server.daemon_threads = True
+
+	@property
+	def address(self):
+		return self._server.server_address[:2]
+
+	def start(self):
+		threading.Thread(target=self._server.serve_forever, daemon=True).start()
+		return self
+
+	def stop(self):
+		self._server.shutdown()
+		self._server.server_close()
+
+	def _get_handler(self):
+		server = self
+
+		class Handler(socketserver.BaseRequestHandler):
+			def recv(self, n):
+				data = b''
+				while len(data) < n:
+					chunk = self.request.recv(n - len(data))
+					if not chunk:
+						raise ConnectionError('closed')
+					data += chunk
+				return data
+
+			def handle(self):
+				_, num_methods = self.recv(2)
+				if 2 not in self.recv(num_methods):
+					self.request.sendall(b'\x05\xff')
+					return
+				self.request.sendall(b'\x05\x02')
+				_, username_len = self.recv(2)
+				username = self.recv(username_len).decode()
+				self.recv(self.recv(1)[0])
+				with server._lock:
+					server.usernames.append(username)
+				if username in server.blocked:
+					self.request.sendall(b'\x01\x01')
+					return
+				self.request.sendall(b'\x01\x00')
+
+				_, _, _, address_type = self.recv(4)
+				if address_type == 1:
+					host = socket.inet_ntoa(self.recv(4))
+				elif address_type == 3:
+					host = self.recv(self.recv(1)[0]).decode()
+				else:
+					host = socket.inet_ntop(socket.AF_INET6, self.recv(16))
+				port, = struct.unpack('>H', self.recv(2))
+				upstream = socket.create_connection((host, port))
+				self.request.sendall(b'\x05\x00\x00\x01' + bytes(6))
+				threading.Thread(target=self.relay, args=[upstream, self.request], daemon=True).start()
+				self.relay(self.request, upstream)
+
+			def relay(self, source, target):
+				try:
+					while True:
+						data = source.recv(65536)
+						if not data:
+							break
+						target.sendall(data)
+				except OSError:
+					pass
+				finally:
+					try:
+						target.shutdown(socket.SHUT_WR)
+					except OSError:
+						pass
+
+		return Handler
+
+class FakeController:
+	"""Stands in for a stem controller, counting signals.
+	"""
+	def __init__(self):
+		self.signals = 0
+
+	def is_alive(self):
+		return True
+
+	def signal(self, signal):
+		self.signals += 1
+
+def serve_http():
+	class Handler(BaseHTTPRequestHandler):
+		def do_GET(self):
+			body = b'{"data": []}'
+			self.send_response(200)
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			pass
+
+	server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+def check(name, ok):
+	print('{}: {}'.format('ok' if ok else 'FAILED', name))
+	return ok
+
+def check_sync(socks, url, size=4):
+	host, port = socks.address
+	pool = TorPool(size, host=host, port=port, control_port=None)
+	circuits = [pool.acquire() for _ in range(size)]
+	for circuit in circuits:
+		circuit.session.get(url, timeout=10)
+	results = [check('each circuit connects with its own credentials', set(socks.usernames) == set(c.username for c in circuits)
+		and len(set(socks.usernames)) == size)]
+
+	circuit = circuits[0]
+	username = circuit.username
+	socks.blocked.add(username)
+	try:
+		circuit.session.get(url, timeout=10)
+		failed = False
+	except Exception:
+		failed = True
+	replaced = failed and pool.fail(circuit)
+	circuit.session.get(url, timeout=10)
+	results.append(check('a failed circuit is replaced by new credentials', replaced and circuit.username != username
+		and socks.usernames[-1] == circuit.username and pool.renewals == 1))
+	for circuit in circuits:
+		pool.release(circuit)
+	return all(results)
+
+async def check_async(socks, url):
+	host, port = socks.address
+	pool = TorPool(2, host=host, port=port, control_port=None)
+	circuit = AsyncCircuit(pool.get_circuits(1)[0], limit=4, timeout=aiohttp.ClientTimeout(total=0.5))
+	socks.blocked.add(circuit.circuit.username)
+
+	session = circuit.session
+	failures = 0
+	for _ in range(3):
+		try:
+			async with circuit.session.get(url) as res:
+				await res.read()
+			break
+		except (aiohttp.ClientError, ProxyError):
+			failures += 1
+			await circuit.fail(circuit.session)
+	results = [check('a failed async circuit is replaced by new credentials', failures == 1 and circuit.session is not session
+		and socks.usernames[-1] == circuit.circuit.username)]
+
+	# Failures of requests sent on the old session leave the new one alone
+	await circuit.fail(session)
+	results.append(check('late failures of a replaced session are ignored', pool.renewals == 1 and not session.closed))
+	await asyncio.sleep(0.6)
+	await circuit.fail(circuit.session)
+	results.append(check('a replaced session is closed once its requests timed out', session.closed))
+	await circuit.close()
+	return all(results)
+
+def check_newnym():
+	pool = TorPool(1, host=None, control_port=9051, newnym_interval=0.5)
+	controller = FakeController()
+	pool._get_controller = lambda: controller
+	circuit = pool.acquire()
+	for _ in range(5):
+		pool.fail(circuit)
+	first = controller.signals
+	time.sleep(0.6)
+	pool.fail(circuit)
+	return check('NEWNYM is sent at most once per newnym_interval', first == 1 and controller.signals == 2
+		and pool.renewals == 6 and pool.newnyms == 2)
+
+if __name__ == '__main__':
+	url = serve_http()
+	socks = SocksStandIn().start()
+	try:
+		ok = check_sync(socks, url)
+		ok = asyncio.run(check_async(socks, url)) and ok
+		ok = check_newnym() and ok
+	finally:
+		socks.stop()
+	sys.exit(0 if ok else 1)
@@ -0,0 +1,343 @@
+"""Offline benchmark of twint.run.Search against an emulated adaptive.json endpoint.
+
+Starts a local server in a separate process that serves a guest token
+page and adaptive.json search pages, either synthetic or recorded, then
+runs twint.run.Search end to end once per sink. Reports tweets/sec and
+the time spent in each stage of the hot path, then the peak traced
+memory and the twint lines holding the most of it, from a second run
+under tracemalloc.
+
+Stage times are inclusive: checkData includes Tweet and the sink. With
+`--searches N` the same search runs N times as tasks of one event loop
+through twint.run.SearchMany, so stage times overlap.
+
+Run from the repository root, e.g.
+`python bench/twint_search.py --tweets 5000 --sinks csv json sqlite`
+"""
+import argparse
+import asyncio
+import functools
+import glob
+import json
+import multiprocessing
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SINKS = ['csv', 'json', 'sqlite']
+WORDS = ['stonks', 'only', 'go', 'up', 'buying', 'the', 'dip', 'earnings', 'beat', 'guidance', 'raised', 'puts',
+	'printing', 'to', 'the', 'moon', 'bullish', 'bearish', 'breakout', 'support', 'resistance']
+
+
+def make_pages(num_tweets, page_size=100, search='$GME', start=datetime(2021, 1, 4, tzinfo=timezone.utc), seed=0):
+	"""Get synthetic adaptive.json pages of tweets, newest first, ending with an empty page.
+	"""
+	rng = random.Random(seed)
+	users = {}
+	for i in range(200):
+		users[str(1000 + i)] = {'id_str': str(1000 + i), 'screen_name': 'trader{}'.format(i), 'name': 'Trader {}'.format(i)}
+
+	tweets = []
+	for i in range(num_tweets):
+		created = start + timedelta(seconds=num_tweets - i)
+		text = '{} {} https://t.co/x{}'.format(search, ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 30))), i)
+		user_id = rng.choice(list(users))
+		tweets.append({
+			'id_str': str(1300000000000000000 + num_tweets - i),
+			'conversation_id_str': str(1300000000000000000 + num_tweets - i),
+			'created_at': created.strftime('%a %b %d %H:%M:%S +0000 %Y'),
+			'user_id_str': user_id,
+			'full_text': text,
+			'display_text_range': [0, len(text)],
+			'lang': 'en',
+			'geo': None,
+			'entities': {
+				'user_mentions': [],
+				'urls': [{'expanded_url': 'https://example.com/{}'.format(i)}],
+				'hashtags': [{'text': 'stocks'}] if rng.random() < 0.3 else [],
+				'symbols': [{'text': search.strip('$')}],
+			},
+			'reply_count': rng.randrange(10),
+			'retweet_count': 1 + rng.randrange(100),
+			'favorite_count': rng.randrange(500),
+			'is_quote_status': False,
+		})
+
+	pages = []
+	for offset in range(0, num_tweets + 1, page_size):
+		pages.append(make_page(tweets[offset:offset + page_size], users, len(pages) + 1))
+	return pages
+
+def make_page(tweets, users, next_index):
+	"""Get an adaptive.json page of tweets with a bottom cursor to the page at next_index.
+	"""
+	entries = [{
+		'entryId': 'sq-I-t-{}'.format(tw['id_str']),
+		'content': {'item': {'content': {'tweet': {'id': tw['id_str']}}}},
+	} for tw in tweets]
+	entries.append({
+		'entryId': 'sq-cursor-bottom',
+		'content': {'operation': {'cursor': {'value': 'scroll:{}'.format(next_index)}}},
+	})
+	return {
+		'globalObjects': {
+			'tweets': {tw['id_str']: tw for tw in tweets},
+			'users': {tw['user_id_str']: users[tw['user_id_str']] for tw in tweets},
+		},
+		'timeline': {'instructions': [{'addEntries': {'entries': entries}}]},
+	}
+
+def get_time(tweet):
+	return int(datetime.strptime(tweet['created_at'], '%a %b %d %H:%M:%S %z %Y').timestamp())
+
+def get_tweets(pages):
+	"""Get tweets of pages, newest first, and their users.
+	"""
+	tweets = []
+	users = {}
+	for page in pages:
+		tweets.extend(page['globalObjects']['tweets'].values())
+		users.update(page['globalObjects']['users'])
+	tweets.sort(key=get_time, reverse=True)
+	return tweets, users
+
+def load_pages(directory):
+	"""Get recorded adaptive.json responses in filename order.
+	"""
+	pages = []
+	for filename in sorted(glob.glob(os.path.join(directory, '*.json'))):
+		with open(filename, 'r', encoding='utf-8') as f:
+			pages.append(json.load(f))
+	return pages
+
+def serve(pages, latency, error_rate, conn):
+	"""Serve a guest token at / and pages by cursor at /2/search/adaptive.json.
+
+	Searches with `since:` or `until:` in their query get pages of the
+	tweets in that time range, as searches of a time window do.
+	"""
+	bodies = [json.dumps(page).encode('utf-8') for page in pages]
+	empty = json.dumps({'globalObjects': {'tweets': {}, 'users': {}}, 'timeline': {'instructions': []}}).encode('utf-8')
+	rate_limited = json.dumps({'errors': [{'message': 'Rate limit exceeded', 'code': 88}]}).encode('utf-8')
+	rng = random.Random(0)
+	tweets, users = get_tweets(pages)
+	times = [get_time(tw) for tw in tweets]
+	page_size = max([len(page['globalObjects']['tweets']) for page in pages] + [1])
+	window_bodies = {}
+
+	def get_window_body(since, until, index):
+		key = (since, until, index)
+		if key not in window_bodies:
+			selected = [tw for tw, t in zip(tweets, times) if since <= t < until]
+			batch = selected[index * page_size:(index + 1) * page_size]
+			window_bodies[key] = json.dumps(make_page(batch, users, index + 1)).encode('utf-8') if batch else empty
+		return window_bodies[key]
+
+	class Handler(BaseHTTPRequestHandler):
+		# Keep-alive, as Twitter does, with each response sent in one write
+		protocol_version = 'HTTP/1.1'
+		wbufsize = -1
+
+		def do_GET(self):
+			url = urlparse(self.path)
+			if latency > 0:
+				time.sleep(rng.expovariate(1 / latency))
+			if url.path == '/':
+				status, content_type = 200, 'text/html'
+				body = '<script>document.cookie = decodeURIComponent("gt={}; Max-Age=10800");</script>'.format(
+					rng.randrange(10 ** 18)).encode('utf-8')
+			elif rng.random() < error_rate:
+				status, content_type, body = 429, 'application/json', rate_limited
+			else:
+				status, content_type = 200, 'application/json'
+				query = parse_qs(url.query)
+				cursor = query.get('cursor', ['-1'])[0]
+				index = int(cursor.split(':')[1]) if cursor.startswith('scroll:') else 0
+				since = re.search(r'since:(\d+)', query.get('q', [''])[0])
+				until = re.search(r'until:(\d+)', query.get('q', [''])[0])
+				if since or until:
+					body = get_window_body(int(since.group(1)) if since else 0, int(until.group(1)) if until else 2 ** 63, index)
+				else:
+					body = bodies[index] if index < len(bodies) else empty
+			self.send_response(status)
+			self.send_header('Content-Type', content_type)
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			pass
+
+	server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+	server.daemon_threads = True
+	conn.send('http://127.0.0.1:{}'.format(server.server_address[1]))
+	server.serve_forever()
+
+class StageTimer:
+	"""Wrap functions of twint modules to time each stage.
+	"""
+	def __init__(self):
+		self.seconds = {}
+		self.calls = {}
+		self._patched = []
+
+	def _add(self, stage, elapsed):
+		self.seconds[stage] = self.seconds.get(stage, 0) + elapsed
+		self.calls[stage] = self.calls.get(stage, 0) + 1
+
+	def patch(self, module, name, stage):
+		func = getattr(module, name)
+		if asyncio.iscoroutinefunction(func):
+			@functools.wraps(func)
+			async def wrapper(*args, **kwargs):
+				start = time.perf_counter()
+				try:
+					return await func(*args, **kwargs)
+				finally:
+					self._add(stage, time.perf_counter() - start)
+		else:
+			@functools.wraps(func)
+			def wrapper(*args, **kwargs):
+				start = time.perf_counter()
+				try:
+					return func(*args, **kwargs)
+				finally:
+					self._add(stage, time.perf_counter() - start)
+		setattr(module, name, wrapper)
+		self._patched.append((module, name, func))
+
+	def restore(self):
+		for module, name, func in reversed(self._patched):
+			setattr(module, name, func)
+		self._patched = []
+
+def point_twint_at(base_url):
+	"""Send twint requests to the local server, without tor.
+	"""
+	from twint import get, token, url
+
+	url.base = base_url + '/2/search/adaptive.json'
+	get.newnym = lambda: False
+	token.TokenPool.url = base_url
+
+def make_config(directory, sink, since, until, windows=1):
+	import twint
+
+	c = twint.Config()
+	c.Search = '$GME'
+	c.Since = since
+	c.Until = until
+	c.Windows = windows
+	c.Hide_output = True
+	c.Output = os.path.join(directory, sink)
+	if sink == 'csv':
+		c.Store_csv = True
+	elif sink == 'json':
+		c.Store_json = True
+	elif sink == 'sqlite':
+		c.Output = None
+		c.Database = os.path.join(directory, 'tweets.sqlite')
+	return c
+
+def search(directory, sink, since, until, searches=1, concurrency=1, windows=1):
+	"""Run one search, or many in one event loop with twint.run.SearchMany.
+	"""
+	import twint
+
+	if searches == 1:
+		twint.run.Search(make_config(directory, sink, since, until, windows))
+	else:
+		configs = [make_config(os.path.join(directory, str(i)), sink, since, until, windows) for i in range(searches)]
+		twint.run.SearchMany(configs, concurrency=concurrency)
+
+def run_timed(directory, sink, since, until, searches=1, concurrency=1, windows=1):
+	from twint import feed, get, output
+	from twint.storage import db, write
+
+	timer = StageTimer()
+	timer.patch(get, 'RequestUrl', 'get.RequestUrl')
+	timer.patch(get, 'Response', 'get.Response')
+	timer.patch(feed, 'parse_tweets', 'feed.parse_tweets')
+	timer.patch(output, 'Tweet', 'tweet.Tweet')
+	timer.patch(output, 'checkData', 'output.checkData')
+	timer.patch(write, 'Csv', 'write.Csv')
+	timer.patch(write, 'Json', 'write.Json')
+	timer.patch(db, 'tweets', 'db.tweets')
+	start = time.perf_counter()
+	try:
+		search(directory, sink, since, until, searches, concurrency, windows)
+	finally:
+		timer.restore()
+	return time.perf_counter() - start, timer
+
+def run_traced(directory, sink, since, until, top, searches=1, concurrency=1, windows=1):
+	tracemalloc.start(10)
+	try:
+		search(directory, sink, since, until, searches, concurrency, windows)
+		snapshot = tracemalloc.take_snapshot()
+		_, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	stats = snapshot.filter_traces([tracemalloc.Filter(True, '*twint*')]).statistics('lineno')
+	return peak, stats[:top]
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--tweets', type=int, default=5000, help='number of synthetic tweets')
+	parser.add_argument('--pages', help='directory of recorded adaptive.json responses to serve instead')
+	parser.add_argument('--sinks', nargs='+', choices=SINKS, default=SINKS)
+	parser.add_argument('--latency', type=float, default=0.0, help='mean seconds per response')
+	parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of searches answered with 429')
+	parser.add_argument('--searches', type=int, default=1, help='searches to run at once with twint.run.SearchMany')
+	parser.add_argument('--concurrency', type=int, default=16, help='searches in flight with --searches')
+	parser.add_argument('--windows', type=int, default=1, help='time windows each search is split into')
+	parser.add_argument('--top', type=int, default=10, help='allocation sites to show')
+	parser.add_argument('--no-trace', action='store_true', help='skip the tracemalloc run')
+	args = parser.parse_args()
+
+	pages = load_pages(args.pages) if args.pages else make_pages(args.tweets)
+	parent_conn, child_conn = multiprocessing.Pipe()
+	server = multiprocessing.Process(target=serve, args=(pages, args.latency, args.error_rate, child_conn), daemon=True)
+	server.start()
+	base_url = parent_conn.recv()
+	point_twint_at(base_url)
+
+	# Dates in local time around the served tweets, so that windows split them evenly
+	tweet_times = [get_time(tw) for tw in get_tweets(pages)[0]]
+	since = datetime.fromtimestamp(min(tweet_times)).strftime('%Y-%m-%d %H:%M:%S')
+	until = datetime.fromtimestamp(max(tweet_times) + 1).strftime('%Y-%m-%d %H:%M:%S')
+	try:
+		with tempfile.TemporaryDirectory() as directory:
+			for sink in args.sinks:
+				elapsed, timer = run_timed(os.path.join(directory, 'timed'), sink, since, until, args.searches, args.concurrency,
+					args.windows)
+				tweets = timer.calls.get('output.checkData', 0)
+				print('{}: {} tweets in {:.2f}s ({:.0f} tweets/s), {} requests'.format(
+					sink, tweets, elapsed, tweets / elapsed, timer.calls.get('get.RequestUrl', 0)))
+				for stage in sorted(timer.seconds, key=timer.seconds.get, reverse=True):
+					print('\t{:<20} {:>8.3f}s {:>6.1%} {:>8} calls {:>8.1f}us/call'.format(
+						stage,
+						timer.seconds[stage],
+						timer.seconds[stage] / elapsed,
+						timer.calls[stage],
+						1e6 * timer.seconds[stage] / timer.calls[stage]))
+
+				if not args.no_trace:
+					peak, stats = run_traced(os.path.join(directory, 'traced'), sink, since, until, args.top,
+						args.searches, args.concurrency, args.windows)
+					print('\tpeak traced memory {:.1f} MB, twint lines holding the most memory at the end:'.format(peak / 2 ** 20))
+					for stat in stats:
+						frame = stat.traceback[0]
+						print('\t\t{}:{} {:.1f} KB in {} blocks'.format(
+							os.path.relpath(frame.filename), frame.lineno, stat.size / 1024, stat.count))
+	finally:
+		server.terminate()
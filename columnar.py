@@ -0,0 +1,170 @@
+import itertools
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+try:
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+except ImportError:
+	pa = None
+	pq = None
+
+
+INT_FIELDS = {'approved_at_utc', 'author_created_utc', 'banned_at_utc', 'controversiality', 'created_utc', 'gilded', 'nest_level', 'num_comments', 'num_crossposts', 'pwls', 'reply_delay', 'retrieved_on', 'score', 'subreddit_subscribers', 'thumbnail_height', 'thumbnail_width', 'total_awards_received', 'updated_utc', 'view_count', 'wls',}
+FLOAT_FIELDS = {'upvote_ratio',}
+BOOL_FIELDS = {'allow_live_comments', 'archived', 'author_patreon_flair', 'author_premium', 'brand_safe', 'can_gild', 'can_mod_post', 'collapsed', 'contest_mode', 'hidden', 'is_crosspostable', 'is_gallery', 'is_meta', 'is_original_content', 'is_reddit_media_domain', 'is_robot_indexable', 'is_self', 'is_submitter', 'is_video', 'locked', 'media_only', 'no_follow', 'over_18', 'pinned', 'quarantine', 'score_hidden', 'send_replies', 'spoiler', 'stickied',}
+
+def _require_pyarrow():
+	if pa is None:
+		raise ImportError('Columnar storage requires pyarrow: `pip install pyarrow`')
+
+def get_month(created_utc):
+	return datetime.fromtimestamp(int(created_utc), tz=timezone.utc).strftime('%Y-%m')
+
+def get_schema(fieldnames):
+	"""Get typed schema of fieldnames. Nested values are stored as JSON strings.
+	"""
+	_require_pyarrow()
+	fields = []
+	for name in fieldnames:
+		if name in INT_FIELDS:
+			fields.append(pa.field(name, pa.int64()))
+		elif name in FLOAT_FIELDS:
+			fields.append(pa.field(name, pa.float64()))
+		elif name in BOOL_FIELDS:
+			fields.append(pa.field(name, pa.bool_()))
+		else:
+			fields.append(pa.field(name, pa.string()))
+	return pa.schema(fields)
+
+def _to_type(value, name):
+	if value is None:
+		return None
+	if name in INT_FIELDS:
+		return int(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+	if name in FLOAT_FIELDS:
+		return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+	if name in BOOL_FIELDS:
+		return value if isinstance(value, bool) else None
+	if isinstance(value, str):
+		return value
+	return json.dumps(value)
+
+class ColumnarSink:
+	"""Buffer posts in memory and write them as Parquet row groups.
+
+	Each directory written to is partitioned as
+	`{directory}/month=YYYY-MM/part-*.parquet`. Posts must arrive in ascending `created_utc` order per key, so a buffer
+	is flushed when it is full or when its key moves on to the next month.
+	"""
+	def __init__(self, row_group_size=10000, on_flush=None):
+		_require_pyarrow()
+		self.row_group_size = row_group_size
+		self.on_flush = on_flush
+		self._buffers = {}
+		self._lock = threading.Lock()
+		self._parts = itertools.count()
+
+	def write(self, directory, data, fieldnames, key=None, callback=None):
+		"""Buffer posts under directory. Callback is called once they are all written.
+		"""
+		flushes = []
+		if len(data) == 0 and callback is not None:
+			callback()
+			callback = None
+		with self._lock:
+			for i, post in enumerate(data):
+				month = get_month(post['created_utc'])
+				buffer = self._buffers.get(directory)
+				if buffer is not None and buffer['month'] != month:
+					flushes.append(self._pop(directory))
+					buffer = None
+				if buffer is None:
+					buffer = {'month': month, 'fieldnames': fieldnames, 'key': key, 'rows': [], 'callbacks': []}
+					self._buffers[directory] = buffer
+				buffer['rows'].append(post)
+				# Buffers of a directory are written in order, so the last post's buffer is written last
+				if i == len(data) - 1 and callback is not None:
+					buffer['callbacks'].append(callback)
+				if len(buffer['rows']) >= self.row_group_size:
+					flushes.append(self._pop(directory))
+		for directory, buffer in flushes:
+			self._write(directory, buffer)
+
+	def _pop(self, directory):
+		return directory, self._buffers.pop(directory)
+
+	def _write(self, directory, buffer):
+		fieldnames = buffer['fieldnames']
+		rows = buffer['rows']
+		columns = {name: [_to_type(post.get(name), name) for post in rows] for name in fieldnames}
+		table = pa.Table.from_pydict(columns, schema=get_schema(fieldnames))
+
+		output_dir = os.path.join(directory, 'month={}'.format(buffer['month']))
+		os.makedirs(output_dir, exist_ok=True)
+		filename = os.path.join(output_dir, 'part-{}-{}.parquet'.format(time.time_ns(), next(self._parts)))
+		tmp = '{}.tmp'.format(filename)
+		pq.write_table(table, tmp, row_group_size=self.row_group_size, compression='zstd')
+		os.replace(tmp, filename)
+
+		if self.on_flush is not None:
+			self.on_flush(buffer['key'], rows, os.path.getsize(filename))
+		for callback in buffer['callbacks']:
+			callback()
+
+	def flush(self):
+		"""Write all buffered posts.
+		"""
+		with self._lock:
+			flushes = [self._pop(directory) for directory in list(self._buffers)]
+		for directory, buffer in flushes:
+			self._write(directory, buffer)
+
+	def close(self):
+		self.flush()
+
+def read(directory, columns=None, start=None, end=None):
+	"""Read posts under directory as a DataFrame.
+
+	Only `columns` are read. Month partitions outside `start` and `end`,
+	given as UTC timestamps, are skipped without being opened.
+	"""
+	_require_pyarrow()
+	if not os.path.isdir(directory):
+		return None
+
+	start_month = get_month(start) if start is not None else None
+	end_month = get_month(end) if end is not None else None
+	read_columns = None
+	if columns is not None:
+		read_columns = list(columns)
+		if (start is not None or end is not None) and 'created_utc' not in read_columns:
+			read_columns.append('created_utc')
+
+	tables = []
+	for partition in sorted(os.listdir(directory)):
+		if not partition.startswith('month='):
+			continue
+		month = partition[len('month='):]
+		if start_month is not None and month < start_month:
+			continue
+		if end_month is not None and month > end_month:
+			continue
+		partition_dir = os.path.join(directory, partition)
+		for part in sorted(os.listdir(partition_dir)):
+			if part.endswith('.parquet'):
+				tables.append(pq.read_table(os.path.join(partition_dir, part), columns=read_columns))
+	if len(tables) == 0:
+		return None
+
+	data = pa.concat_tables(tables).to_pandas()
+	if start is not None:
+		data = data[data['created_utc'] >= start]
+	if end is not None:
+		data = data[data['created_utc'] <= end]
+	if columns is not None:
+		data = data[list(columns)]
+	return data.reset_index(drop=True)
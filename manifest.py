@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class Manifest:
+	"""Crawl state of every platform, symbol and post type.
+
+	Each entry holds the last timestamp and id saved, and the row count
+	and byte size of the data file, so that updates can be planned
+	without reading the data files. The first timestamp, page count,
+	recent post rate and last check time are kept for scheduling.
+	"""
+	def __init__(self, filename):
+		self.filename = filename
+		output_dir = os.path.dirname(filename)
+		if output_dir:
+			os.makedirs(output_dir, exist_ok=True)
+
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+		self._conn.row_factory = sqlite3.Row
+		self._conn.execute('PRAGMA journal_mode=WAL')
+		self._conn.execute('PRAGMA synchronous=NORMAL')
+		self._conn.execute('''
+			CREATE TABLE IF NOT EXISTS crawl_state (
+				platform TEXT NOT NULL,
+				symbol TEXT NOT NULL,
+				post_type TEXT NOT NULL,
+				last_time INTEGER,
+				last_id TEXT,
+				row_count INTEGER,
+				byte_size INTEGER,
+				updated_at REAL,
+				first_time INTEGER,
+				pages INTEGER,
+				recent_rate REAL,
+				checked_at REAL,
+				PRIMARY KEY (platform, symbol, post_type)
+			) WITHOUT ROWID''')
+
+		# Add columns missing from manifests of older versions
+		columns = [row['name'] for row in self._conn.execute('PRAGMA table_info(crawl_state)')]
+		for column, column_type in [('first_time', 'INTEGER'), ('pages', 'INTEGER'), ('recent_rate', 'REAL'), ('checked_at', 'REAL')]:
+			if column not in columns:
+				self._conn.execute('ALTER TABLE crawl_state ADD COLUMN {} {}'.format(column, column_type))
+
+	def get(self, platform, symbol, post_type):
+		"""Get crawl state of one file, or None if it was never saved.
+		"""
+		with self._lock:
+			row = self._conn.execute(
+				'SELECT * FROM crawl_state WHERE platform=? AND symbol=? AND post_type=?',
+				(platform, symbol, post_type)).fetchone()
+		return dict(row) if row is not None else None
+
+	def get_all(self, platform):
+		"""Get crawl state of all files of a platform keyed by (symbol, post_type).
+		"""
+		with self._lock:
+			rows = self._conn.execute(
+				'SELECT * FROM crawl_state WHERE platform=?', (platform,)).fetchall()
+		return {(row['symbol'], row['post_type']): dict(row) for row in rows}
+
+	def set(self, platform, symbol, post_type, last_time, last_id=None, row_count=None, byte_size=None, first_time=None):
+		"""Replace crawl state of one file.
+		"""
+		with self._lock:
+			self._conn.execute('''
+				INSERT OR REPLACE INTO crawl_state
+					(platform, symbol, post_type, last_time, last_id, row_count, byte_size, updated_at, first_time)
+				VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+				(platform, symbol, post_type, last_time, last_id, row_count, byte_size, time.time(), first_time))
+
+	def add(self, platform, symbol, post_type, last_time, last_id, rows, nbytes, first_time=None):
+		"""Record a saved page of `rows` rows and `nbytes` bytes in one atomic statement.
+
+		The recent rate is a moving average of rows per second between
+		the previous and the new last timestamp.
+		"""
+		with self._lock:
+			self._conn.execute('''
+				INSERT INTO crawl_state
+					(platform, symbol, post_type, last_time, last_id, row_count, byte_size, updated_at, first_time, pages)
+				VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+				ON CONFLICT (platform, symbol, post_type) DO UPDATE SET
+					last_time=excluded.last_time,
+					last_id=excluded.last_id,
+					row_count=coalesce(row_count, 0) + excluded.row_count,
+					byte_size=coalesce(byte_size, 0) + excluded.byte_size,
+					updated_at=excluded.updated_at,
+					first_time=coalesce(first_time, excluded.first_time),
+					pages=coalesce(pages, 0) + 1,
+					recent_rate=CASE
+						WHEN last_time IS NULL OR excluded.last_time <= last_time THEN recent_rate
+						WHEN recent_rate IS NULL THEN excluded.row_count * 1.0 / (excluded.last_time - last_time)
+						ELSE 0.5 * recent_rate + 0.5 * excluded.row_count / (excluded.last_time - last_time)
+					END''',
+				(platform, symbol, post_type, last_time, last_id, rows, nbytes, time.time(), first_time))
+
+	def check(self, platform, symbol, post_type):
+		"""Record that a file was brought up to date, whether or not it got new rows.
+		"""
+		with self._lock:
+			self._conn.execute('''
+				INSERT INTO crawl_state (platform, symbol, post_type, checked_at) VALUES (?, ?, ?, ?)
+				ON CONFLICT (platform, symbol, post_type) DO UPDATE SET
+					checked_at=excluded.checked_at''',
+				(platform, symbol, post_type, time.time()))
+
+	def close(self):
+		with self._lock:
+			self._conn.close()
@@ -0,0 +1,118 @@
+from collections import deque
+
+
+TEXT_ATTRS = ['title', 'selftext', 'body']
+_SEPARATORS = str.maketrans(',;.', '   ')
+
+def tokenize(text):
+	"""Split lowercased text into words the way cashtags are detected.
+	"""
+	return text.translate(_SEPARATORS).split()
+
+class SymbolMatcher:
+	"""Match text against the query terms of many symbols in one pass.
+
+	Company names are found as substrings with an Aho-Corasick automaton.
+	Symbols are found as exact words, and symbols that are common English
+	words only as exact cashtags, e.g. `$ALL`.
+	"""
+	def __init__(self, routes):
+		"""Build from (symbol, term, names, detect_cashtag) routes.
+		"""
+		self.symbols = []
+		self._words = {}
+		self._goto = [{}]
+		self._fail = [0]
+		self._out = [()]
+
+		for symbol, term, names, detect_cashtag in routes:
+			index = len(self.symbols)
+			self.symbols.append(symbol['symbol'] if isinstance(symbol, dict) else symbol)
+			if term is not None:
+				self._add_word(term, index)
+				if not detect_cashtag:
+					self._add_word('${}'.format(term), index)
+			for name in names:
+				self._add_name(name.lower(), index)
+		self._build()
+
+	def _add_word(self, word, index):
+		self._words.setdefault(word, set()).add(index)
+
+	def _add_name(self, name, index):
+		node = 0
+		for c in name:
+			nxt = self._goto[node].get(c)
+			if nxt is None:
+				nxt = len(self._goto)
+				self._goto[node][c] = nxt
+				self._goto.append({})
+				self._fail.append(0)
+				self._out.append(())
+			node = nxt
+		if index not in self._out[node]:
+			self._out[node] = self._out[node] + (index,)
+
+	def _build(self):
+		"""Link failure transitions breadth first.
+		"""
+		queue = deque(self._goto[0].values())
+		while queue:
+			node = queue.popleft()
+			for c, nxt in self._goto[node].items():
+				queue.append(nxt)
+				fail = self._fail[node]
+				while fail and c not in self._goto[fail]:
+					fail = self._fail[fail]
+				self._fail[nxt] = self._goto[fail].get(c, 0)
+				if self._out[self._fail[nxt]]:
+					self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+	def _match_indices(self, text, found):
+		text = text.lower()
+
+		# Company names
+		goto, fail, out = self._goto, self._fail, self._out
+		node = 0
+		for c in text:
+			while node and c not in goto[node]:
+				node = fail[node]
+			node = goto[node].get(c, 0)
+			if out[node]:
+				found.update(out[node])
+
+		# Symbols and cashtags
+		words = self._words
+		for word in tokenize(text):
+			indices = words.get(word)
+			if indices:
+				found.update(indices)
+		return found
+
+	def match(self, text):
+		"""Get all symbols matched in text.
+		"""
+		return {self.symbols[i] for i in self._match_indices(text, set())}
+
+	def match_post(self, post):
+		"""Get all symbols matched in the text fields of a post.
+		"""
+		found = set()
+		for attr in TEXT_ATTRS:
+			if isinstance(post.get(attr), str):
+				self._match_indices(post[attr], found)
+		return {self.symbols[i] for i in found}
+
+	def match_posts(self, posts):
+		"""Get matched symbols of each post.
+		"""
+		return [self.match_post(post) for post in posts]
+
+	def route(self, posts):
+		"""Map each matched symbol to its posts, in order.
+		"""
+		routed = {}
+		for post, symbols in zip(posts, self.match_posts(posts)):
+			for symbol in symbols:
+				routed.setdefault(symbol, []).append(post)
+		return routed
@@ -0,0 +1,226 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _format_labels(labels, extra=None):
+	items = list(labels)
+	if extra is not None:
+		items.append(extra)
+	if len(items) == 0:
+		return ''
+	return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in items) + '}'
+
+class Histogram:
+	def __init__(self, buckets):
+		self.buckets = buckets
+		self.counts = [0] * len(buckets)
+		self.count = 0
+		self.sum = 0
+
+	def observe(self, value):
+		for i, bound in enumerate(self.buckets):
+			if value <= bound:
+				self.counts[i] += 1
+		self.count += 1
+		self.sum += value
+
+class Metrics:
+	"""Counters, gauges, histograms and worker states of a running scraper.
+
+	Exposed in Prometheus text format by `serve` and written as a JSON
+	snapshot with per-second rates of counters by `start_snapshots`.
+	"""
+	def __init__(self, prefix='scraper'):
+		self.prefix = prefix
+		self.started = time.time()
+		self._counters = {}
+		self._counter_funcs = {}
+		self._gauges = {}
+		self._gauge_funcs = {}
+		self._histograms = {}
+		self._workers = {}
+		self._lock = threading.Lock()
+		self._last_snapshot = None
+
+	@staticmethod
+	def _key(name, labels):
+		return name, tuple(sorted(labels.items()))
+
+	def inc(self, name, value=1, **labels):
+		key = self._key(name, labels)
+		with self._lock:
+			self._counters[key] = self._counters.get(key, 0) + value
+
+	def set_counter_func(self, name, func, **labels):
+		"""Set a counter read from func whenever metrics are collected, for counts kept elsewhere.
+		"""
+		with self._lock:
+			self._counter_funcs[self._key(name, labels)] = func
+
+	def set(self, name, value, **labels):
+		with self._lock:
+			self._gauges[self._key(name, labels)] = value
+
+	def set_func(self, name, func, **labels):
+		"""Set a gauge read from func whenever metrics are collected.
+		"""
+		with self._lock:
+			self._gauge_funcs[self._key(name, labels)] = func
+
+	def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+		key = self._key(name, labels)
+		with self._lock:
+			histogram = self._histograms.get(key)
+			if histogram is None:
+				histogram = Histogram(buckets)
+				self._histograms[key] = histogram
+			histogram.observe(value)
+
+	def set_state(self, platform, worker_id, state):
+		"""Set what a worker is doing, e.g. the symbol it downloads or 'idle'.
+		"""
+		with self._lock:
+			self._workers[(platform, str(worker_id))] = (state, time.time())
+
+	@staticmethod
+	def _call(values, funcs):
+		for key, func in funcs:
+			try:
+				values[key] = func()
+			except Exception:
+				pass
+		return values
+
+	def _collect_counters(self):
+		with self._lock:
+			counters = dict(self._counters)
+			funcs = list(self._counter_funcs.items())
+		return self._call(counters, funcs)
+
+	def _collect_gauges(self):
+		with self._lock:
+			gauges = dict(self._gauges)
+			funcs = list(self._gauge_funcs.items())
+		return self._call(gauges, funcs)
+
+	def render(self):
+		"""Get metrics in Prometheus text format.
+		"""
+		counters = self._collect_counters()
+		gauges = self._collect_gauges()
+		now = time.time()
+		lines = []
+		with self._lock:
+			seen = set()
+			for (name, labels), value in sorted(counters.items()):
+				if name not in seen:
+					lines.append('# TYPE {}_{} counter'.format(self.prefix, name))
+					seen.add(name)
+				lines.append('{}_{}{} {}'.format(self.prefix, name, _format_labels(labels), value))
+			for (name, labels), value in sorted(gauges.items()):
+				if name not in seen:
+					lines.append('# TYPE {}_{} gauge'.format(self.prefix, name))
+					seen.add(name)
+				lines.append('{}_{}{} {}'.format(self.prefix, name, _format_labels(labels), value))
+			for (name, labels), histogram in sorted(self._histograms.items()):
+				if name not in seen:
+					lines.append('# TYPE {}_{} histogram'.format(self.prefix, name))
+					seen.add(name)
+				for bound, count in zip(histogram.buckets, histogram.counts):
+					lines.append('{}_{}_bucket{} {}'.format(self.prefix, name, _format_labels(labels, ('le', bound)), count))
+				lines.append('{}_{}_bucket{} {}'.format(self.prefix, name, _format_labels(labels, ('le', '+Inf')), histogram.count))
+				lines.append('{}_{}_sum{} {}'.format(self.prefix, name, _format_labels(labels), histogram.sum))
+				lines.append('{}_{}_count{} {}'.format(self.prefix, name, _format_labels(labels), histogram.count))
+			lines.append('# TYPE {}_worker_state_seconds gauge'.format(self.prefix))
+			for (platform, worker_id), (state, since) in sorted(self._workers.items()):
+				labels = (('platform', platform), ('worker', worker_id), ('state', state))
+				lines.append('{}_worker_state_seconds{} {:.3f}'.format(self.prefix, _format_labels(labels), now - since))
+			lines.append('# TYPE {}_uptime_seconds gauge'.format(self.prefix))
+			lines.append('{}_uptime_seconds {:.3f}'.format(self.prefix, now - self.started))
+		return '\n'.join(lines) + '\n'
+
+	def snapshot(self, advance=True):
+		"""Get metrics as a dict, with per-second rates of counters since the last snapshot.
+
+		With advance=False the next snapshot still measures rates from the last one.
+		"""
+		counters = self._collect_counters()
+		gauges = self._collect_gauges()
+		now = time.time()
+		with self._lock:
+			if self._last_snapshot is None:
+				last_time, last_counters = self.started, {}
+			else:
+				last_time, last_counters = self._last_snapshot
+			if advance:
+				self._last_snapshot = (now, counters)
+			elapsed = max(now - last_time, 1e-9)
+
+			def name_of(key):
+				name, labels = key
+				return name + _format_labels(labels)
+
+			histograms = {}
+			for key, histogram in self._histograms.items():
+				histograms[name_of(key)] = {
+					'count': histogram.count,
+					'mean': histogram.sum / histogram.count if histogram.count else None,
+					'buckets': dict(zip([str(b) for b in histogram.buckets], histogram.counts)),
+				}
+			return {
+				'time': now,
+				'uptime': now - self.started,
+				'counters': {name_of(key): value for key, value in counters.items()},
+				'rates': {name_of(key): (value - last_counters.get(key, 0)) / elapsed for key, value in counters.items()},
+				'gauges': {name_of(key): value for key, value in gauges.items()},
+				'histograms': histograms,
+				'workers': {'{}/{}'.format(*key): {'state': state, 'seconds': now - since}
+					for key, (state, since) in self._workers.items()},
+			}
+
+	def serve(self, port, host='127.0.0.1'):
+		"""Serve /metrics in Prometheus text format and /metrics.json from a daemon thread.
+		"""
+		metrics = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path == '/metrics':
+					body = metrics.render().encode('utf-8')
+					content_type = 'text/plain; version=0.0.4'
+				elif self.path == '/metrics.json':
+					body = json.dumps(metrics.snapshot(advance=False), indent=2).encode('utf-8')
+					content_type = 'application/json'
+				else:
+					self.send_error(404)
+					return
+				self.send_response(200)
+				self.send_header('Content-Type', content_type)
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				pass
+
+		server = ThreadingHTTPServer((host, port), Handler)
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		return server
+
+	def start_snapshots(self, filename, interval=10):
+		"""Write a JSON snapshot to filename every interval seconds from a daemon thread.
+		"""
+		def run():
+			while True:
+				time.sleep(interval)
+				tmp_filename = filename + '.tmp'
+				with open(tmp_filename, 'w', encoding='utf-8') as f:
+					json.dump(self.snapshot(), f, indent=2)
+				os.replace(tmp_filename, filename)
+
+		threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,105 @@
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+
+class PostStore:
+	"""Store each post once by id, with a symbol index for time range reads.
+
+	A post matching many symbols is stored once in `posts` and referenced
+	from `symbol_posts` by (symbol, post_type, created_utc, id), so the
+	per-symbol view is rebuilt on read.
+	"""
+	def __init__(self, filename):
+		self.filename = filename
+		output_dir = os.path.dirname(filename)
+		if output_dir:
+			os.makedirs(output_dir, exist_ok=True)
+
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+		self._conn.execute('PRAGMA journal_mode=WAL')
+		self._conn.execute('PRAGMA synchronous=NORMAL')
+		self._conn.execute('''
+			CREATE TABLE IF NOT EXISTS posts (
+				post_type TEXT NOT NULL,
+				id TEXT NOT NULL,
+				created_utc INTEGER NOT NULL,
+				data BLOB NOT NULL,
+				PRIMARY KEY (post_type, id)
+			) WITHOUT ROWID''')
+		self._conn.execute('''
+			CREATE TABLE IF NOT EXISTS symbol_posts (
+				symbol TEXT NOT NULL,
+				post_type TEXT NOT NULL,
+				created_utc INTEGER NOT NULL,
+				id TEXT NOT NULL,
+				PRIMARY KEY (symbol, post_type, created_utc, id)
+			) WITHOUT ROWID''')
+
+	def write(self, symbol, post_type, data):
+		"""Store posts of symbol and return the number of bytes of new posts.
+		"""
+		posts = []
+		index = []
+		for post in data:
+			blob = zlib.compress(json.dumps(post, separators=(',', ':')).encode('utf-8'))
+			posts.append((post_type, post['id'], int(post['created_utc']), blob))
+			index.append((symbol, post_type, int(post['created_utc']), post['id']))
+
+		with self._lock:
+			self._conn.execute('BEGIN')
+			try:
+				nbytes = 0
+				for row in posts:
+					# Keep the first copy of a post already stored for another symbol
+					cur = self._conn.execute('INSERT OR IGNORE INTO posts VALUES (?, ?, ?, ?)', row)
+					if cur.rowcount > 0:
+						nbytes += len(row[3])
+				self._conn.executemany('INSERT OR IGNORE INTO symbol_posts VALUES (?, ?, ?, ?)', index)
+				self._conn.execute('COMMIT')
+			except Exception:
+				self._conn.execute('ROLLBACK')
+				raise
+		return nbytes
+
+	def read(self, symbol, post_type, start=None, end=None):
+		"""Get posts of symbol in created_utc order, optionally within a time range.
+		"""
+		query = '''
+			SELECT p.data FROM symbol_posts s
+			JOIN posts p ON p.post_type = s.post_type AND p.id = s.id
+			WHERE s.symbol = ? AND s.post_type = ?'''
+		args = [symbol, post_type]
+		if start is not None:
+			query += ' AND s.created_utc >= ?'
+			args.append(start)
+		if end is not None:
+			query += ' AND s.created_utc <= ?'
+			args.append(end)
+		query += ' ORDER BY s.created_utc, s.id'
+
+		with self._lock:
+			rows = self._conn.execute(query, args).fetchall()
+		return [json.loads(zlib.decompress(row[0])) for row in rows]
+
+	def get(self, post_type, ids):
+		"""Get stored posts by id.
+		"""
+		ids = list(ids)
+		posts = {}
+		with self._lock:
+			for i in range(0, len(ids), 500):
+				batch = ids[i:i + 500]
+				rows = self._conn.execute(
+					'SELECT id, data FROM posts WHERE post_type = ? AND id IN ({})'.format(','.join('?' * len(batch))),
+					[post_type] + batch).fetchall()
+				for _id, blob in rows:
+					posts[_id] = json.loads(zlib.decompress(blob))
+		return posts
+
+	def close(self):
+		with self._lock:
+			self._conn.close()
@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import time
+
+
+class EndpointLimit:
+	"""Token bucket and statistics of one endpoint.
+	"""
+	def __init__(self, rate, burst):
+		self.rate = rate
+		self.burst = burst
+		self.tokens = burst
+		self.updated = time.monotonic()
+		self.blocked_until = 0
+		self.last_decrease = 0
+		self.consecutive_failures = 0
+		self.requests = 0
+		self.successes = 0
+		self.throttled = 0
+		self.errors = 0
+		self.latency = None
+
+	def refill(self, now):
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def stats(self):
+		return {
+			'rate': self.rate,
+			'requests': self.requests,
+			'successes': self.successes,
+			'throttled': self.throttled,
+			'errors': self.errors,
+			'latency': self.latency,
+			'consecutive_failures': self.consecutive_failures,
+		}
+
+class RateGovernor:
+	"""Process-wide request rate limit with additive increase, multiplicative decrease.
+
+	Every request takes a token from its endpoint's bucket. A success
+	raises the endpoint's rate by about `increase` requests/sec per second.
+	A 429, a 5xx or a connection error cuts the rate by `decrease`, at
+	most once per `cooldown` seconds, and blocks the endpoint for an
+	exponential backoff shared by all workers.
+	"""
+	def __init__(self, rate=4.0, min_rate=0.2, max_rate=64.0, burst=8, increase=0.5, decrease=0.5,
+			cooldown=2.0, backoff=1.0, max_backoff=120.0):
+		self.initial_rate = rate
+		self.min_rate = min_rate
+		self.max_rate = max_rate
+		self.burst = burst
+		self.increase = increase
+		self.decrease = decrease
+		self.cooldown = cooldown
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self._limits = {}
+		self._lock = threading.Lock()
+
+	def _get_limit(self, endpoint):
+		limit = self._limits.get(endpoint)
+		if limit is None:
+			limit = EndpointLimit(self.initial_rate, self.burst)
+			self._limits[endpoint] = limit
+		return limit
+
+	def _reserve(self, endpoint):
+		"""Take a token and get how long to wait before using it.
+		"""
+		with self._lock:
+			now = time.monotonic()
+			limit = self._get_limit(endpoint)
+			limit.refill(now)
+			limit.tokens -= 1
+			limit.requests += 1
+			wait = 0
+			if limit.tokens < 0:
+				wait = -limit.tokens / limit.rate
+			return max(wait, limit.blocked_until - now)
+
+	def acquire(self, endpoint):
+		wait = self._reserve(endpoint)
+		if wait > 0:
+			time.sleep(wait)
+
+	async def acquire_async(self, endpoint):
+		wait = self._reserve(endpoint)
+		if wait > 0:
+			await asyncio.sleep(wait)
+
+	def report(self, endpoint, status, latency):
+		"""Adjust the rate of endpoint from a response status, or None on a connection error.
+		"""
+		with self._lock:
+			now = time.monotonic()
+			limit = self._get_limit(endpoint)
+			if limit.latency is None:
+				limit.latency = latency
+			else:
+				limit.latency = 0.9 * limit.latency + 0.1 * latency
+
+			if status is not None and status < 400:
+				limit.successes += 1
+				limit.consecutive_failures = 0
+				limit.rate = min(self.max_rate, limit.rate + self.increase / limit.rate)
+				return
+
+			if status == 429 or (status is not None and status >= 500):
+				limit.throttled += 1
+			else:
+				limit.errors += 1
+			if status is not None and status < 500 and status != 429:
+				# Client errors are not a sign of load
+				return
+
+			limit.consecutive_failures += 1
+			if now - limit.last_decrease > self.cooldown:
+				limit.rate = max(self.min_rate, limit.rate * self.decrease)
+				limit.tokens = min(limit.tokens, 0)
+				limit.last_decrease = now
+			backoff = min(self.max_backoff, self.backoff * 2 ** (limit.consecutive_failures - 1))
+			limit.blocked_until = max(limit.blocked_until, now + backoff)
+
+	def get_stats(self):
+		with self._lock:
+			return {endpoint: limit.stats() for endpoint, limit in self._limits.items()}
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class ResponseCache:
+	"""Compressed API responses keyed by url and normalized params.
+
+	A page is kept forever once it has settled, i.e. it cannot change
+	anymore because all of its posts are older than `settle` seconds.
+	Pages near the present expire after `ttl` seconds. Least recently
+	used pages are evicted once the cache grows past `max_bytes`.
+	"""
+	def __init__(self, filename, ttl=3600, settle=86400, max_bytes=2 ** 30):
+		self.filename = filename
+		self.ttl = ttl
+		self.settle = settle
+		self.max_bytes = max_bytes
+		self.hits = 0
+		self.misses = 0
+		output_dir = os.path.dirname(filename)
+		if output_dir:
+			os.makedirs(output_dir, exist_ok=True)
+
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+		self._conn.execute('PRAGMA journal_mode=WAL')
+		self._conn.execute('PRAGMA synchronous=NORMAL')
+		self._conn.execute('''
+			CREATE TABLE IF NOT EXISTS responses (
+				key TEXT PRIMARY KEY,
+				data BLOB NOT NULL,
+				size INTEGER NOT NULL,
+				expires REAL,
+				accessed REAL NOT NULL
+			) WITHOUT ROWID''')
+		self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+		self._size = self._conn.execute('SELECT coalesce(sum(size), 0) FROM responses').fetchone()[0]
+
+	@staticmethod
+	def get_key(url, params):
+		params = sorted((str(k), str(v)) for k, v in params.items())
+		return hashlib.sha1(json.dumps([url, params]).encode('utf-8')).hexdigest()
+
+	def get(self, url, params):
+		"""Get a cached page, or None if it is missing or expired.
+		"""
+		key = self.get_key(url, params)
+		now = time.time()
+		with self._lock:
+			row = self._conn.execute('SELECT data, expires FROM responses WHERE key=?', (key,)).fetchone()
+			if row is None or (row[1] is not None and row[1] < now):
+				self.misses += 1
+				return None
+			self._conn.execute('UPDATE responses SET accessed=? WHERE key=?', (now, key))
+			self.hits += 1
+		return json.loads(zlib.decompress(row[0]))
+
+	def is_settled(self, params, data):
+		"""Whether a page of posts sorted by created_utc can no longer change.
+		"""
+		horizon = time.time() - self.settle
+		if 'before' in params and int(params['before']) < horizon:
+			return True
+		# A full page ends at its last post, a partial page at the present
+		full = 'size' in params and len(data) >= int(params['size'])
+		return full and int(data[-1]['created_utc']) < horizon
+
+	def put(self, url, params, data):
+		key = self.get_key(url, params)
+		blob = zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+		now = time.time()
+		expires = None if self.is_settled(params, data) else now + self.ttl
+		with self._lock:
+			row = self._conn.execute('SELECT size FROM responses WHERE key=?', (key,)).fetchone()
+			if row is not None:
+				self._size -= row[0]
+			self._conn.execute(
+				'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+				(key, blob, len(blob), expires, now))
+			self._size += len(blob)
+			if self._size > self.max_bytes:
+				self._evict()
+
+	def _evict(self):
+		# Expired pages first, then least recently used until under 90% of the cap
+		self._conn.execute('DELETE FROM responses WHERE expires < ?', (time.time(),))
+		self._size = self._conn.execute('SELECT coalesce(sum(size), 0) FROM responses').fetchone()[0]
+		target = int(self.max_bytes * 0.9)
+		while self._size > target:
+			rows = self._conn.execute('SELECT key, size FROM responses ORDER BY accessed LIMIT 100').fetchall()
+			if len(rows) == 0:
+				break
+			evicted = []
+			for key, size in rows:
+				if self._size <= target:
+					break
+				evicted.append((key,))
+				self._size -= size
+			self._conn.executemany('DELETE FROM responses WHERE key=?', evicted)
+
+	def close(self):
+		with self._lock:
+			self._conn.close()
@@ -0,0 +1,175 @@
+import threading
+import time
+
+
+class Window:
+	"""Posts of a job created strictly between `after` and `before`.
+	"""
+	def __init__(self, job, after, before):
+		self.job = job
+		self.after = after
+		self.before = before
+		self.cursor = after
+		self.started = False
+		self.done = False
+
+	def remaining(self):
+		return self.before - self.cursor
+
+class WindowScheduler:
+	"""Hand out time windows of jobs to workers, splitting running windows for idle workers.
+
+	An idle worker steals the later half of the running window with the
+	most time left. The windows of a job stay disjoint and together cover
+	its whole range, so their output can be merged back in order once
+	the last one is done.
+	"""
+	def __init__(self, min_span=3600):
+		self.min_span = min_span
+		self._jobs = {}
+		self._pending = []
+		self._running = []
+		self._cond = threading.Condition()
+
+	def add_job(self, job, after, before):
+		with self._cond:
+			window = Window(job, after, before)
+			self._jobs[job] = [window]
+			self._pending.append(window)
+			self._cond.notify()
+
+	def _steal(self):
+		candidates = [w for w in self._running if w.started and w.remaining() >= 2 * self.min_span]
+		if len(candidates) == 0:
+			return None
+		victim = max(candidates, key=Window.remaining)
+		mid = (victim.cursor + victim.before) // 2
+		window = Window(victim.job, mid - 1, victim.before)
+		victim.before = mid
+		self._jobs[victim.job].append(window)
+		return window
+
+	def next(self):
+		"""Get a window to work on, or None once all windows are done.
+		"""
+		with self._cond:
+			while True:
+				if len(self._pending) > 0:
+					window = self._pending.pop(0)
+				else:
+					window = self._steal()
+				if window is not None:
+					self._running.append(window)
+					return window
+				if len(self._running) == 0:
+					return None
+				self._cond.wait(1)
+
+	def advance(self, window, data):
+		"""Keep posts of a page that still belong to window and move its cursor.
+
+		Returns the kept posts and whether the window is finished.
+		"""
+		with self._cond:
+			keep = [post for post in data if int(post['created_utc']) < window.before]
+			done = len(data) == 0 or len(keep) < len(data)
+			if len(keep) > 0:
+				window.cursor = int(keep[-1]['created_utc'])
+				window.started = True
+			self._cond.notify_all()
+			return keep, done
+
+	def finish(self, window):
+		"""Mark window done. Returns the job's windows in order once all are done.
+		"""
+		with self._cond:
+			window.done = True
+			self._running.remove(window)
+			self._cond.notify_all()
+			windows = self._jobs[window.job]
+			if all(w.done for w in windows):
+				del self._jobs[window.job]
+				return sorted(windows, key=lambda w: w.after)
+			return None
+
+class PriorityScheduler:
+	"""Order update jobs by the number of new posts they are expected to have.
+
+	The post rate of a job is the recent rate from its crawl state, or
+	else its average over all saved rows. Posts expected since the last
+	check are discounted by how long the job has gone without posts.
+	Requests are estimated from the rows per page the job saved so far,
+	at most `page_size`. Jobs are taken in that order until their
+	estimated requests fill `budget`. Jobs never checked come first and
+	jobs not checked for `max_interval` seconds come next, so cold
+	symbols are still polled.
+	Jobs checked without ever having posts are cold too. Jobs checked
+	within `min_interval` seconds are skipped.
+	"""
+	def __init__(self, budget=None, page_size=500, min_interval=0, max_interval=7 * 86400):
+		self.budget = budget
+		self.page_size = page_size
+		self.min_interval = min_interval
+		self.max_interval = max_interval
+
+	def get_rate(self, state):
+		"""Get posts per second of a crawl state.
+		"""
+		if state['recent_rate'] is not None:
+			return state['recent_rate']
+		if state['first_time'] is not None and state['last_time'] is not None and state['row_count']:
+			return state['row_count'] / max(state['last_time'] - state['first_time'], 86400)
+		return 0
+
+	def get_page_size(self, state):
+		"""Get posts per request of a crawl state, from the pages it saved.
+		"""
+		if state['pages'] and state['row_count']:
+			return max(1, min(self.page_size, state['row_count'] / state['pages']))
+		return self.page_size
+
+	def get_priority(self, state, now):
+		"""Get (tier, expected new posts, estimated requests) of a job.
+		"""
+		if state is None or (state['last_time'] is None and state['checked_at'] is None):
+			return 0, 0, 1
+		checked = max(state['checked_at'] or 0, state['updated_at'] or 0)
+		elapsed = now - checked
+		if elapsed < self.min_interval:
+			return None
+		if state['last_time'] is None:
+			# Checked and never had posts
+			return 1 if elapsed >= self.max_interval else 2, 0, 1
+		quiet = max(now - state['last_time'], 0)
+		expected = self.get_rate(state) * elapsed / (1 + quiet / self.max_interval)
+		requests = 1 + int(expected // self.get_page_size(state))
+		tier = 1 if elapsed >= self.max_interval else 2
+		return tier, expected, requests
+
+	def plan(self, jobs, states, now=None):
+		"""Get jobs to run in order.
+
+		Jobs is a list of (key, job) and states maps keys to crawl state.
+		"""
+		if now is None:
+			now = time.time()
+		ranked = []
+		for i, (key, job) in enumerate(jobs):
+			priority = self.get_priority(states.get(key), now)
+			if priority is not None:
+				tier, expected, requests = priority
+				ranked.append((tier, -expected, i, requests, job))
+		ranked.sort(key=lambda x: x[:3])
+
+		planned = []
+		total = 0
+		for tier, _, _, requests, job in ranked:
+			if self.budget is not None:
+				if total >= self.budget:
+					break
+				# Jobs never crawled or overdue may take what is left
+				if tier == 2 and total + requests > self.budget:
+					continue
+			total += requests
+			planned.append(job)
+		return planned
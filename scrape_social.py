@@ -3,76 +3,122 @@
 # The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import aiohttp
+import asyncio
+import columnar
 import csv
+import functools
+import hashlib
+import io
 import json
 import math
 import os
 import pandas as pd
 import requests
+import shutil
 import sys
 import threading
 import time
 import twint
+import zlib
+from aiohttp_socks import ProxyConnectionError, ProxyError, ProxyTimeoutError
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
+from manifest import Manifest
+from matcher import SymbolMatcher, TEXT_ATTRS, tokenize
+from metrics import Metrics
+from post_store import PostStore
 from nltk.corpus import words as en_words
-from stem import Signal
-from stem.control import Controller
-from queue import Queue
+from queue import Empty, Queue
+from ratelimit import RateGovernor
+from response_cache import ResponseCache
+from scheduler import PriorityScheduler, WindowScheduler
+from tor_pool import AsyncCircuit, TorPool
+from writer import CsvWriter
 
 
 NUM_WORKERS = 64
+NUM_CONNECTIONS = 512
 SYMBOL_TABLE = 'symbol_data/symbol_table.csv'
+DICTIONARY_CACHE = 'symbol_data/en_words.bin'
+QUERY_TABLE = 'symbol_data/query_table.json'
+MANIFEST = 'manifest.sqlite'
+POST_STORE = 'posts.sqlite'
+METRICS_SNAPSHOT = 'metrics.json'
+RESPONSE_CACHE = 'response_cache.sqlite'
+WINDOW_DIR = '.windows'
+WINDOW_MIN_SPAN = 3600
+# Twitter searches longer than this many days are split into concurrent windows
+TWITTER_WINDOW_DAYS = 90
+TWITTER_MAX_WINDOWS = 8
+# Fields requested from Pushshift and written to csv, by profile and post type
+FIELD_PROFILES = {
+	'minimal': {
+		'submission': ['created_utc', 'id', 'author', 'score', 'num_comments', 'title', 'selftext'],
+		'comment': ['created_utc', 'id', 'author', 'score', 'link_id', 'body'],
+	},
+}
+# Fields that change after a post is saved, refreshed by id
+ENGAGEMENT_FIELDS = {
+	'submission': ['score', 'num_comments'],
+	'comment': ['score'],
+}
+REFRESH_BATCH_SIZE = 500
+THREAD_BATCH_SIZE = 100
+# Threads are harvested once their submission is this old, when most comments are in
+THREAD_SETTLE = 86400
 COMMON_SYMBOLS = ['ALL', 'AN', 'ANY', 'BIG', 'BRO', 'BUY', 'CALM', 'CAN', 'CAP', 'ECO', 'DIET', 'DIG', 'DIM', 'DOG', 'DROP', 'EAT', 'EDIT', 'EVER', 'FAME', 'FAN', 'FAST', 'FAT', 'FATE', 'FIVE', 'FLOW', 'FOUR', 'FUD', 'FUN', 'GOLD', 'GOOD', 'HAS', 'HEAR', 'HOLD', 'HOME', 'HOPE', 'IT', 'JOB', 'JUST', 'KEY', 'KEYS', 'KNOW', 'LAWS', 'LAZY', 'LIFE', 'LOAN', 'LOVE', 'MAN', 'MOM', 'MOON', 'NEAR', 'NEED', 'NERD', 'NEW', 'NEXT', 'NICE', 'NINE', 'NOW', 'ONE', 'OUT', 'PAYS', 'PLAN', 'PLAY', 'PUMP', 'ROLL', 'ROOF', 'ROOT', 'SACH', 'SAFE', 'SAIL', 'SAND', 'SALT', 'SAVE', 'SEE', 'SEED', 'SEEK', 'SIX', 'SNOW', 'SO', 'SUB', 'SUP', 'TELL', 'TEN', 'TRUE', 'TWO', 'UNIT', 'VERY', 'WELL', 'WHEN', 'WOW', 'YELL', 'YOLO']
 START_FROM = 'A'
 
-class Tor:
-	def __init__(self):
-		self.is_tor_renewing = False
+tor = TorPool(NUM_WORKERS)
+# twint rotates circuits through the same throttled NEWNYM
+twint.get.newnym = lambda: tor.newnym()
+governor = RateGovernor()
+metrics = Metrics()
+metrics.set_counter_func('tor_renewals', lambda: tor.renewals)
+metrics.set_counter_func('tor_newnyms', lambda: tor.newnyms)
 
-	def get_tor_session(self, renew=False):
-		"""Use the tor network as a proxy.
-		"""
-		if renew:
-			self.renew_connection()
-
-		while self.is_tor_renewing:
-			time.sleep(0.1)
-
-		session = requests.session()
-		session.proxies = {
-			'http': 'socks5://127.0.0.1:9050',
-			'https': 'socks5://127.0.0.1:9050',
-		}
-		return session
+class Dictionary:
+	def __init__(self, cache=DICTIONARY_CACHE):
+		self.cache = cache
+		self._lower_en_words = None
 
-	def renew_connection(self):
-		"""Establish a clean pathway through the tor network.
+	@property
+	def lower_en_words(self):
+		"""Lowercased English words, loaded on first use.
 		"""
-		while self.is_tor_renewing:
-			time.sleep(0.2)
-
-		self.is_tor_renewing = True
-		with Controller.from_port(port=9051) as c:
-			password = os.environ.get('TOR_CONTROLLER_PW')
-			c.authenticate(password=password)
-			c.signal(Signal.NEWNYM)
-		self.is_tor_renewing = False
-
-
-tor = Tor()
+		if self._lower_en_words is None:
+			self._lower_en_words = self.load()
+		return self._lower_en_words
 
-class Dictionary:
-	def __init__(self):
+	def load(self):
+		"""Load words from the cache, building the cache if it is missing.
+		"""
+		if os.path.isfile(self.cache):
+			with open(self.cache, 'rb') as f:
+				return frozenset(zlib.decompress(f.read()).decode('utf-8').split('\n'))
 		try:
-			self.initialize()
+			words = self.initialize()
 		except LookupError:
 			import nltk
 			nltk.download('words')
-			self.initialize()
+			words = self.initialize()
+		self.save(words)
+		return words
 
 	def initialize(self):
-		self.lower_en_words = [w.lower() for w in en_words.words()]
+		return frozenset(w.lower() for w in en_words.words())
+
+	def save(self, words):
+		"""Write words as a compressed, newline-delimited list.
+		"""
+		cache_dir = os.path.dirname(self.cache)
+		if cache_dir:
+			os.makedirs(cache_dir, exist_ok=True)
+		tmp = '{}.tmp'.format(self.cache)
+		with open(tmp, 'wb') as f:
+			f.write(zlib.compress('\n'.join(sorted(words)).encode('utf-8'), 9))
+		os.replace(tmp, self.cache)
 
 	def is_word(self, word):
 		"""Check if word exists in the English dictionary.
@@ -101,6 +147,37 @@ def sanitize(s, delimiter='|'):
 	res = ' '.join(res.split())
 	return res
 
+class RowEncoder:
+	"""Encode a page of posts into sanitized csv rows.
+
+	Gives the same cells as sanitizing each value and writing it with
+	csv.DictWriter. A list or dict only goes through a sanitized JSON
+	round trip if its dump contains the delimiter or runs of spaces,
+	which are the only things sanitize changes in a JSON dump.
+	"""
+	def __init__(self, fieldnames, delimiter='|'):
+		self.fieldnames = fieldnames
+		self.delimiter = delimiter
+
+	def encode(self, data):
+		delimiter = self.delimiter
+		fieldnames = self.fieldnames
+		rows = []
+		for post in data:
+			row = []
+			for field in fieldnames:
+				value = post.get(field)
+				if isinstance(value, str):
+					value = ' '.join(value.replace(delimiter, ',').split())
+				elif isinstance(value, (list, dict)):
+					dump = json.dumps(value)
+					if delimiter in dump or '  ' in dump:
+						value = json.loads(sanitize(dump, delimiter))
+				# csv writer formats numbers, bools and None
+				row.append(value)
+			rows.append(row)
+		return rows
+
 def fs_encode(symbol):
 	"""Encode symbol into filesystem-safe string.
 	"""
@@ -109,14 +186,38 @@ def fs_encode(symbol):
 	res = res.replace('/', '-')
 	return res
 
+def drain_queue(jobs):
+	"""Drop the jobs left in a queue, marking them done.
+	"""
+	while True:
+		try:
+			jobs.get_nowait()
+		except Empty:
+			return
+		jobs.task_done()
+
+async def run_blocking(func, *args):
+	"""Run a blocking call, e.g. on files, sqlite or a full writer queue, in the default executor.
+	"""
+	return await asyncio.get_event_loop().run_in_executor(None, functools.partial(func, *args))
+
 class TWITTER:
 	def __init__(self, directory):
 		self.directory = directory
+		self.platform = 'twitter'
+		self.manifest = Manifest(os.path.join(directory, MANIFEST))
+		twint.get.report = self._report
+		metrics.set_counter_func('tokens_fetched_total', lambda: twint.token.get_counts()[0], platform=self.platform)
+		metrics.set_counter_func('tokens_expired_total', lambda: twint.token.get_counts()[1], platform=self.platform)
 
 	def get_filename(self, symbol):
 		output_dir = os.path.join(self.directory, fs_encode(symbol))
 		return os.path.join(output_dir, 'tweets.csv')
 
+	def _report(self, url, status, latency):
+		metrics.inc('requests_total', platform=self.platform, status=status if status is not None else 'error')
+		metrics.observe('request_seconds', latency, platform=self.platform)
+
 	def get_last_date(self, filename):
 		"""Get latest time from data.
 		"""
@@ -125,13 +226,18 @@ class TWITTER:
 		data['new_date'] = pd.to_datetime(data['new_date'], format='%Y-%m-%d %H:%M:%S')
 		return data['new_date'].max()
 
-	def _download_tweets(self, symbol, start_date, end_date):
+	def _get_search(self, symbol, start_date, end_date):
+		"""Get twint config of a search of symbol from where its file left off, with its crawl state and start.
+		"""
 		filename = self.get_filename(symbol['symbol'])
 		output_dir = os.path.join(*filename.split(os.path.sep)[:-1])
 
 		# Update from last date
 		last_date = start_date
-		if os.path.isfile(filename):
+		state = self.manifest.get(self.platform, symbol['symbol'], 'tweet')
+		if state is not None and state['last_time'] is not None:
+			last_date = datetime.fromtimestamp(state['last_time'])
+		elif os.path.isfile(filename):
 			last_date = self.get_last_date(filename)
 
 		# Adjust PST to UTC
@@ -152,40 +258,142 @@ class TWITTER:
 		c.Hide_output = True
 		c.Store_csv = True
 		c.Proxy_host = 'tor'
-		twint.run.Search(c)
+		c.Windows = max(1, min(TWITTER_MAX_WINDOWS, (end_date - last_date).days // TWITTER_WINDOW_DAYS))
+		return c, state, last_date
+
+	def _read_appended(self, filename, offset):
+		"""Get rows appended to a csv after byte offset.
+		"""
+		with open(filename, 'rb') as f:
+			header = f.readline()
+			f.seek(max(offset, len(header)))
+			return pd.read_csv(io.BytesIO(header + f.read()), sep=',', usecols=['date', 'time'])
 
-		print('Twitter done {} {}'.format(symbol['symbol'], until))
+	def _record_search(self, symbol, state, error=None):
+		"""Record rows a search appended, resuming after the newest tweet saved.
 
-	def download_tweets(self, symbol):
+		A search that stopped on errors leaves the crawl state as it was, so
+		that the next search covers the same time again.
+		"""
+		if error is not None:
+			print('Twitter failed {} {}'.format(symbol['symbol'], error))
+			metrics.inc('search_errors_total', platform=self.platform)
+			return
+		metrics.inc('searches_total', platform=self.platform)
+
+		filename = self.get_filename(symbol['symbol'])
+		prev_size = (state['byte_size'] or 0) if state is not None else 0
+		byte_size = os.path.getsize(filename) if os.path.isfile(filename) else 0
+		data = self._read_appended(filename, prev_size) if byte_size > prev_size else None
+		if data is None or len(data) == 0:
+			self.manifest.check(self.platform, symbol['symbol'], 'tweet')
+			print('Twitter done {} no new tweets'.format(symbol['symbol']))
+			return
+
+		dates = pd.to_datetime(data['date'] + ' ' + data['time'], format='%Y-%m-%d %H:%M:%S')
+		# Naive dates in local time, as get_last_date reads them
+		last_date = dates.max().to_pydatetime()
+		first_date = dates.min().to_pydatetime()
+		self.manifest.add(self.platform, symbol['symbol'], 'tweet', int(last_date.timestamp()), None,
+			len(data), byte_size - prev_size, int(first_date.timestamp()))
+		metrics.inc('posts_total', len(data), platform=self.platform, post_type='tweet')
+		metrics.inc('bytes_total', byte_size - prev_size, platform=self.platform, post_type='tweet')
+		print('Twitter done {} {}'.format(symbol['symbol'], last_date.strftime('%Y-%m-%d %H:%M:%S')))
+
+	def _download_tweets(self, symbol, start_date, end_date):
+		c, state, last_date = self._get_search(symbol, start_date, end_date)
+		start = time.time()
+		try:
+			twint.run.Search(c)
+			error = c.Search_error
+		except Exception as e:
+			error = repr(e)
+		metrics.observe('search_seconds', time.time() - start, platform=self.platform)
+		self._record_search(symbol, state, error)
+
+	def get_dates(self):
 		last_date = datetime.strptime('2011-03-01', '%Y-%m-%d')
 		# now = datetime.strptime('2011-12-01', '%Y-%m-%d')
 		now = datetime.now()
-		self._download_tweets(symbol, last_date, now)
+		return last_date, now
+
+	def download_tweets(self, symbol):
+		self._download_tweets(symbol, *self.get_dates())
 
-	def work(self, jobs):
+	def work(self, jobs, worker_id):
 		while not jobs.empty():
 			kwargs = jobs.get()
-			self.download_tweets(**kwargs)
-			jobs.task_done()
-
-	def update(self, use_threads=True):
+			metrics.set_state(self.platform, worker_id, kwargs['symbol']['symbol'])
+			try:
+				self.download_tweets(**kwargs)
+			except Exception:
+				# Workers stop on errors, e.g. of the writer; skip the jobs left so that join returns
+				drain_queue(jobs)
+				raise
+			finally:
+				jobs.task_done()
+		metrics.set_state(self.platform, worker_id, 'idle')
+
+	def update(self, use_threads=True, budget=None):
 		"""Warning: using threads might cross the rate limit and get you banned.
 		"""
+		candidates = []
 		symbols = get_symbols()
+		for symbol in symbols:
+			if symbol['symbol'][0] >= START_FROM:
+				candidates.append(((symbol['symbol'], 'tweet'), symbol))
+		states = self.manifest.get_all(self.platform)
+		# Twitter searches return about 20 tweets per request
+		planned = PriorityScheduler(budget, page_size=20).plan(candidates, states)
+		print('Twitter planned {} of {} jobs'.format(len(planned), len(candidates)))
+
 		if use_threads:
 			jobs = Queue()
-			for symbol in symbols:
-				if symbol['symbol'][0] >= START_FROM:
-					jobs.put({'symbol':symbol})
-			for _ in range(NUM_WORKERS):
-				worker = threading.Thread(target=self.work, args=[jobs])
+			for symbol in planned:
+				jobs.put({'symbol':symbol})
+			metrics.set_func('queue_depth', jobs.qsize, platform=self.platform, queue='jobs')
+			for worker_id in range(NUM_WORKERS):
+				worker = threading.Thread(target=self.work, args=[jobs, worker_id])
 				worker.start()
 			jobs.join()
 		else:
-			for symbol in symbols:
+			for symbol in planned:
 				self.download_tweets(symbol)
 		print('Twitter update complete')
 
+	def update_async(self, budget=None, concurrency=NUM_WORKERS):
+		"""Run planned searches as tasks of one event loop, sharing a guest token and connection pool.
+		"""
+		candidates = []
+		symbols = get_symbols()
+		for symbol in symbols:
+			if symbol['symbol'][0] >= START_FROM:
+				candidates.append(((symbol['symbol'], 'tweet'), symbol))
+		states = self.manifest.get_all(self.platform)
+		planned = PriorityScheduler(budget, page_size=20).plan(candidates, states)
+		print('Twitter planned {} of {} jobs'.format(len(planned), len(candidates)))
+
+		start_date, end_date = self.get_dates()
+		configs = []
+		searches = {}
+		for symbol in planned:
+			c, state, _ = self._get_search(symbol, start_date, end_date)
+			configs.append(c)
+			searches[id(c)] = (symbol, state)
+
+		def callback(config, task):
+			symbol, state = searches[id(config)]
+			if task.cancelled():
+				error = 'cancelled'
+			elif task.exception() is not None:
+				error = repr(task.exception())
+			else:
+				error = config.Search_error
+			self._record_search(symbol, state, error)
+
+		twint.run.SearchMany(configs, concurrency=concurrency, callback=callback)
+		print('Twitter update complete')
+
 	def get_data(self):
 		data = {}
 		symbols = get_symbols()
@@ -199,19 +407,62 @@ class TWITTER:
 		return data
 
 class REDDIT:
-	def __init__(self, directory, subreddit, delimiter='|'):
+	def __init__(self, directory, subreddit, delimiter='|', storage='csv', cache=False, profile='full'):
 		self.subreddit = subreddit
 		self.directory = directory
 		self.delimiter = delimiter
+		self.storage = storage
+		if profile != 'full' and profile not in FIELD_PROFILES:
+			raise Exception('Must provide valid profile.')
+		self.profile = profile
+		# Posts of other profiles go to their own files and manifest states
+		self.suffix = '' if profile == 'full' else '_{}'.format(profile)
+		self.sink = None
+		self.store = None
+		if storage == 'parquet':
+			self.sink = columnar.ColumnarSink(on_flush=self._on_flush)
+		elif storage == 'store':
+			root, ext = os.path.splitext(POST_STORE)
+			self.store = PostStore(os.path.join(directory, root + self.suffix + ext))
+		elif storage != 'csv':
+			raise Exception('Must provide valid storage.')
 		self.url = 'https://api.pushshift.io/reddit/search/{}'
+		self.platform = 'reddit_{}{}'.format(subreddit, self.suffix)
+		self.manifest = Manifest(os.path.join(directory, MANIFEST))
+		self.writer = CsvWriter(delimiter)
+		metrics.set_func('queue_depth', self.writer.qsize, platform=self.platform, queue='writer')
+		self.cache = None
+		if cache:
+			self.cache = ResponseCache(os.path.join(directory, RESPONSE_CACHE))
+		self._query_table = None
+		self._query_table_lock = threading.Lock()
+		self._cashtag_matchers = {}
 		self.comment_fieldnames = ['created_utc', 'all_awardings', 'associated_award', 'author', 'author_cakeday', 'author_created_utc', 'author_flair_background_color', 'author_flair_css_class', 'author_flair_richtext', 'author_flair_template_id', 'author_flair_text', 'author_flair_text_color', 'author_flair_type', 'author_fullname', 'author_patreon_flair', 'author_premium', 'awarders', 'body', 'can_gild', 'collapsed', 'collapsed_because_crowd_control', 'collapsed_reason', 'comment_type', 'controversiality', 'distinguished', 'edited', 'gilded', 'gildings', 'id', 'is_submitter', 'link_id', 'locked', 'media_metadata', 'mod_removed', 'no_follow', 'nest_level', 'parent_id', 'permalink', 'permalink_url', 'reply_delay', 'retrieved_on', 'score', 'score_hidden', 'send_replies', 'stickied', 'subreddit', 'subreddit_id', 'subreddit_type', 'top_awarded_type', 'total_awards_received', 'treatment_tags', 'updated_utc', 'user_removed',]
 		self.submission_fieldnames = ['created_utc', 'all_awardings', 'allow_live_comments', 'approved_at_utc', 'archived', 'author', 'author_cakeday', 'author_created_utc', 'author_flair_background_color', 'author_flair_css_class', 'author_flair_richtext', 'author_flair_template_id', 'author_flair_text', 'author_flair_text_color', 'author_flair_type', 'author_fullname', 'author_id', 'author_patreon_flair', 'author_premium', 'awarders', 'banned_at_utc', 'banned_by', 'brand_safe', 'can_gild', 'can_mod_post', 'category', 'content_categories', 'contest_mode', 'crosspost_parent', 'crosspost_parent_list', 'distinguished', 'domain', 'edited', 'full_link', 'gallery_data', 'gilded', 'gildings', 'hidden', 'id', 'is_crosspostable', 'is_gallery', 'is_meta', 'is_original_content', 'is_reddit_media_domain', 'is_robot_indexable', 'is_self', 'is_video', 'link_flair_background_color', 'link_flair_css_class', 'link_flair_richtext', 'link_flair_template_id', 'link_flair_text', 'link_flair_text_color', 'link_flair_type', 'locked', 'media', 'media_embed', 'media_metadata', 'media_only', 'mod_reports', 'no_follow', 'num_comments', 'num_crossposts', 'over_18', 'parent_whitelist_status', 'permalink', 'pinned', 'post_hint', 'preview', 'previous_visits', 'pwls', 'quarantine', 'removal_reason', 'removed_by_category', 'retrieved_on', 'rte_mode', 'score', 'secure_media', 'secure_media_embed', 'selftext', 'send_replies', 'spoiler', 'stickied', 'subreddit', 'subreddit_id', 'subreddit_name_prefixed', 'suggested_sort', 'subreddit_subscribers', 'subreddit_type', 'thumbnail', 'thumbnail_height', 'thumbnail_width', 'treatment_tags', 'title', 'total_awards_received', 'updated_utc', 'upvote_ratio', 'url', 'url_overridden_by_dest', 'user_reports', 'view_count', 'whitelist_status', 'wls',]
 
 	def get_filename(self, symbol, post_type):
 		output_dir = os.path.join(self.directory, fs_encode(symbol))
-		return os.path.join(output_dir, '{}_{}.csv'.format(self.subreddit, post_type))
+		return os.path.join(output_dir, '{}_{}{}.csv'.format(self.subreddit, post_type, self.suffix))
+
+	def get_columnar_dir(self, symbol, post_type):
+		output_dir = os.path.join(self.directory, fs_encode(symbol))
+		return os.path.join(output_dir, '{}_{}{}'.format(self.subreddit, post_type, self.suffix))
+
+	def get_engagement_filename(self, symbol, post_type):
+		output_dir = os.path.join(self.directory, fs_encode(symbol))
+		return os.path.join(output_dir, '{}_{}{}_engagement.csv'.format(self.subreddit, post_type, self.suffix))
+
+	def get_search_type(self, post_type):
+		"""Get the Pushshift endpoint of a post type, where comments harvested by thread are comments.
+		"""
+		return 'comment' if post_type == 'thread_comment' else post_type
 
 	def get_fieldnames(self, post_type):
+		post_type = self.get_search_type(post_type)
+		if self.profile != 'full':
+			if post_type not in FIELD_PROFILES[self.profile]:
+				raise Exception('Must provide valid post type.')
+			return FIELD_PROFILES[self.profile][post_type]
 		if post_type == 'submission':
 			return self.submission_fieldnames
 		elif post_type == 'comment':
@@ -233,26 +484,128 @@ class REDDIT:
 			last_line = lines[-1]
 		return last_line.split(self.delimiter)[0]
 
-	def save_data(self, data, filename, fieldnames):
-		"""Append data to csv.
+	def get_start_time(self, symbol, post_type):
+		"""Get time to resume from, from the manifest or else the CSV.
+		"""
+		state = self.manifest.get(self.platform, symbol, post_type)
+		if state is not None and state['last_time'] is not None:
+			return state['last_time']
+
+		filename = self.get_filename(symbol, post_type)
+		if not os.path.isfile(filename):
+			return 0
+
+		# Seed manifest from CSV written before it existed
+		last_time = int(float(self.get_last_time(filename)))
+		first_time = None
+		row_count = 0
+		with open(filename, 'r', encoding='utf-8') as f:
+			f.readline()
+			for line in f:
+				if first_time is None:
+					first_time = int(float(line.split(self.delimiter)[0]))
+				row_count += 1
+		self.manifest.set(self.platform, symbol, post_type, last_time,
+			row_count=row_count, byte_size=os.path.getsize(filename), first_time=first_time)
+		return last_time
+
+	def _save_posts(self, symbol, post_type, data, callback=None):
+		"""Save posts of symbol and record them in the manifest. Callback is called once they are written.
+		"""
+		if self.sink is not None:
+			# Recorded in the manifest once flushed
+			output_dir = self.get_columnar_dir(symbol, post_type)
+			self.sink.write(output_dir, data, self.get_fieldnames(post_type), key=(symbol, post_type), callback=callback)
+			return
+
+		if self.store is not None:
+			nbytes = self.store.write(symbol, post_type, data)
+			if len(data) > 0:
+				self._on_flush((symbol, post_type), data, nbytes)
+			if callback is not None:
+				callback()
+			return
+
+		# Recorded in the manifest once written
+		if len(data) > 0:
+			first_time, last_time, last_id, rows = data[0]['created_utc'], data[-1]['created_utc'], data[-1].get('id'), len(data)
+
+		def on_write(nbytes):
+			if len(data) > 0:
+				self._record(symbol, post_type, first_time, last_time, last_id, rows, nbytes)
+			if callback is not None:
+				callback()
+		filename = self.get_filename(symbol, post_type)
+		self.save_data(data, filename, self.get_fieldnames(post_type), on_write)
+
+	def _on_flush(self, key, data, nbytes):
+		symbol, post_type = key
+		self._record(symbol, post_type, data[0]['created_utc'], data[-1]['created_utc'], data[-1].get('id'), len(data), nbytes)
+
+	def _record(self, symbol, post_type, first_time, last_time, last_id, rows, nbytes):
+		self.manifest.add(self.platform, symbol, post_type, last_time, last_id, rows, nbytes, first_time)
+		metrics.inc('posts_total', rows, platform=self.platform, post_type=post_type)
+		metrics.inc('bytes_total', nbytes, platform=self.platform, post_type=post_type)
+
+	def close(self):
+		"""Write out buffered posts.
 		"""
-		file_exists = os.path.exists(filename)
+		self.writer.close()
+		if self.sink is not None:
+			self.sink.close()
+		if self.cache is not None:
+			print('Reddit cache {} hits, {} misses'.format(self.cache.hits, self.cache.misses))
 
-		# Create data path
-		path = filename.split(os.path.sep)
-		cur_path = ''
-		for p in path[:-1]:
-			cur_path = os.path.join(cur_path, p)
-			if not os.path.exists(cur_path):
-				os.makedirs(cur_path)
+	def read_data(self, symbol, post_type, columns=None, start=None, end=None, refreshed=False):
+		"""Read saved posts of symbol, optionally only some columns and a time range.
+
+		With refreshed=True, engagement columns take their values from the
+		last `refresh` where it found the post.
+		"""
+		data = self._read_data(symbol, post_type, columns, start, end)
+		if not refreshed or data is None or 'id' not in data.columns:
+			return data
+		filename = self.get_engagement_filename(symbol, post_type)
+		if not os.path.isfile(filename):
+			return data
+		engagement = pd.read_csv(filename, sep=self.delimiter).drop_duplicates('id', keep='last').set_index('id')
+		for field in ENGAGEMENT_FIELDS[self.get_search_type(post_type)]:
+			if field in data.columns and field in engagement.columns:
+				values = data['id'].map(engagement[field])
+				found = values.notna()
+				data.loc[found, field] = values[found]
+		return data
 
-		with open(filename, 'a', encoding='utf-8') as f:
-			dw = csv.DictWriter(f, delimiter=self.delimiter, extrasaction='ignore', fieldnames=fieldnames)
-			# dw = csv.DictWriter(f, delimiter=self.delimiter, fieldnames=self.comment_fieldnames)
-			if not file_exists:
-				dw.writeheader()
-			for datum in data:
-				dw.writerow(datum)
+	def _read_data(self, symbol, post_type, columns, start, end):
+		if self.sink is not None:
+			return columnar.read(self.get_columnar_dir(symbol, post_type), columns, start, end)
+		if self.store is not None:
+			posts = self.store.read(symbol, post_type, start, end)
+			if len(posts) == 0:
+				return None
+			columns = columns if columns is not None else self.get_fieldnames(post_type)
+			return pd.DataFrame(posts, columns=columns)
+
+		filename = self.get_filename(symbol, post_type)
+		if not os.path.isfile(filename):
+			return None
+		usecols = None
+		if columns is not None:
+			usecols = set(columns) | {'created_utc'}
+		data = pd.read_csv(filename, sep=self.delimiter, usecols=usecols)
+		if start is not None:
+			data = data[data['created_utc'] >= start]
+		if end is not None:
+			data = data[data['created_utc'] <= end]
+		if columns is not None:
+			data = data[list(columns)]
+		return data.reset_index(drop=True)
+
+	def save_data(self, data, filename, fieldnames, callback=None):
+		"""Queue data to append to csv. Callback gets the number of bytes once written.
+		"""
+		rows = RowEncoder(fieldnames, self.delimiter).encode(data)
+		self.writer.write(filename, fieldnames, rows, callback)
 
 	def _to_company_name(self, orig_name):
 		name = orig_name.split(',')[0]
@@ -323,7 +676,9 @@ class REDDIT:
 				query_set.append(q)
 		return query_set
 
-	def _download_data(self, symbol, post_type, start_time=0, session=None):
+	def _compile_query(self, symbol):
+		"""Get query terms of symbol and whether to detect its cashtag.
+		"""
 		query_set = self._get_query_str(symbol)
 
 		# Symbols with cashtag
@@ -334,106 +689,593 @@ class REDDIT:
 			detect_cashtag = True
 		elif len(symbol['symbol']) > 1:
 			query_set.insert(0, symbol['symbol'])
+		return query_set, detect_cashtag
 
-		query = '|'.join(query_set)
+	def _get_symbol_table_hash(self):
+		h = hashlib.sha256()
+		with open(SYMBOL_TABLE, 'rb') as f:
+			h.update(f.read())
+		h.update('|'.join(COMMON_SYMBOLS).encode('utf-8'))
+		return h.hexdigest()
 
-		# No query
-		if len(query) == 0:
-			print('\tNo query {}|{}|{}'.format(symbol['symbol'], symbol['shortName'], symbol['longName']))
-			return []
-		# if post_type == 'comment':
-		print('\t{}'.format(query), '==', '{}|{}|{}'.format(symbol['symbol'], symbol['shortName'], symbol['longName']))
+	def build_query_table(self, filename=QUERY_TABLE):
+		"""Compile queries of all symbols into a table keyed by symbol.
+		"""
+		table = {
+			'hash': self._get_symbol_table_hash(),
+			'queries': {},
+		}
+		for symbol in get_symbols():
+			query_set, detect_cashtag = self._compile_query(symbol)
+			table['queries'][symbol['symbol']] = {
+				'query_set': query_set,
+				'detect_cashtag': detect_cashtag,
+				'directory': fs_encode(symbol['symbol']),
+			}
+
+		tmp = '{}.tmp'.format(filename)
+		with open(tmp, 'w', encoding='utf-8') as f:
+			json.dump(table, f)
+		os.replace(tmp, filename)
+		return table
+
+	def get_query_table(self, filename=QUERY_TABLE):
+		"""Load the query table, rebuilding it if the symbol table changed.
+		"""
+		with self._query_table_lock:
+			if self._query_table is None:
+				table = None
+				if os.path.isfile(filename):
+					with open(filename, 'r', encoding='utf-8') as f:
+						table = json.load(f)
+				if table is None or table['hash'] != self._get_symbol_table_hash():
+					table = self.build_query_table(filename)
+				self._query_table = table['queries']
+		return self._query_table
+
+	def _get_query(self, symbol):
+		"""Get query terms of symbol and whether to detect its cashtag.
+		"""
+		query = self.get_query_table().get(symbol['symbol'])
+		if query is None:
+			return self._compile_query(symbol)
+		return list(query['query_set']), query['detect_cashtag']
 
-		# Request
+	def _get_params(self, query, start_time, post_type):
 		params = {
 			'subreddit': self.subreddit,
 			'size': 500,
 			'sort': 'asc',
 			'sort_type': 'created_utc',
 			'after': start_time,
-			'q': query,
 			# 'score': '>1',
 		}
+		# No query pages through the whole subreddit
+		if query is not None:
+			params['q'] = query
+		# Full profile takes all fields Pushshift has
+		if self.profile != 'full':
+			params['fields'] = ','.join(self.get_fieldnames(post_type))
+		return params
+
+	def _filter_cashtag(self, symbol, query_set, data):
+		"""Match symbol cashtag, if text contains it.
+
+		Returns posts and whether to save them. A page filtered to zero is
+		returned whole, so the cursor moves past it, but is not saved.
+		"""
+		matcher = self._cashtag_matchers.get(symbol['symbol'])
+		if matcher is None:
+			# The exact cashtag or a name, as routed by the crawl
+			matcher = SymbolMatcher([(symbol, query_set[0].lower(), query_set[1:], True)])
+			self._cashtag_matchers[symbol['symbol']] = matcher
+		lower_symbol = symbol['symbol'].lower()
+		new_data = []
+		for post in data:
+			# Text with the symbol but neither its exact cashtag nor a name uses it as a word
+			if all(lower_symbol not in post[attr].lower() or matcher.match(post[attr]) for attr in TEXT_ATTRS if attr in post):
+				new_data.append(post)
+		# Data is non zero but was filtered to zero
+		if len(new_data) == 0 and len(data) > 0:
+			return data, False
+		return new_data, True
+
+	def _save_page(self, symbol, post_type, data):
+		"""Save a page of posts, sanitized on write if saved to csv.
+		"""
+		# Append data
+		self._save_posts(symbol, post_type, data)
 
-		if session is None:
-			raise Exception('Session is unspecified.')
+		return data
 
-		url = self.url.format(post_type)
-		# res = requests.get(url, params=params)
-		res = session.get(url, params=params)
+	def _request(self, session, url, params, cache=True):
+		"""Get a page of posts through the cache and rate governor, or None if the request failed.
+		"""
+		if cache and self.cache is not None:
+			data = self.cache.get(url, params)
+			if data is not None:
+				metrics.inc('cache_hits_total', platform=self.platform)
+				return data
+
+		governor.acquire(url)
+		start = time.time()
+		try:
+			res = session.get(url, params=params, timeout=120)
+		except requests.exceptions.RequestException:
+			self._report(url, None, time.time() - start)
+			return None
+		latency = time.time() - start
 		if res.status_code != 200:
+			self._report(url, res.status_code, latency)
 			return None
-
 		# Data is a list of dicts
-		data = res.json()['data']
-		# print(json.dumps(data[0], indent=4, sort_keys=True))
+		try:
+			data = res.json()['data']
+		except (ValueError, KeyError, TypeError):
+			# Not a Pushshift response, e.g. an HTML error page
+			self._report(url, None, latency)
+			return None
+		self._report(url, res.status_code, latency)
+		if cache and self.cache is not None:
+			self.cache.put(url, params, data)
+		return data
 
-		# Match symbol cashtag, if text contains it
-		if detect_cashtag:
-			new_data = []
-			for post in data:
-				is_valid_post = True
-				for attr in ['title', 'selftext', 'body']:
-					if attr not in post:
-						continue
-					# Check if something other than a symbol matched
-					matched_query_set = False
-					for q in query_set[1:]:
-						if q in post[attr].lower():
-							matched_query_set = True
-							break
-					# Check if exact cashtag symbol matches
-					if not matched_query_set:
-						cashtag = query_set[0].lower()
-						post_words = post[attr].lower()
-						post_words = post_words.replace(',', ' ')
-						post_words = post_words.replace(';', ' ')
-						post_words = post_words.replace('.', ' ')
-						post_words = post_words.split()
-						if symbol['symbol'].lower() in post[attr].lower() and cashtag not in post_words:
-							is_valid_post = False
-							break
-
-						# is_valid_post = False
-						# blob = TextBlob(post[attr])
-						# for word, tag in blob.tags:
-						# 	if word.lower() == symbol['symbol'].lower() and tag == 'NNP':
-						# 		is_valid_post = True
-						# 		print(word, tag)
-
-				# Append only valid posts
-				if is_valid_post:
-					new_data.append(post)
-			# Data is non zero but was filtered to zero
-			if len(new_data) == 0 and len(data) > 0:
+	async def _request_async(self, session, url, params):
+		"""Coroutine version of `_request` using an aiohttp session.
+		"""
+		if self.cache is not None:
+			data = await run_blocking(self.cache.get, url, params)
+			if data is not None:
+				metrics.inc('cache_hits_total', platform=self.platform)
 				return data
-			# Replace
-			data = new_data
-
-		# Sanitize values for csv
-		for i in range(len(data)):
-			for k in data[i]:
-				if isinstance(data[i][k], str):
-					data[i][k] = sanitize(data[i][k], self.delimiter)
-				else:
-					dump = json.dumps(data[i][k])
-					data[i][k] = json.loads(sanitize(dump, self.delimiter))
-
-		# Append data to csv
-		filename = self.get_filename(symbol['symbol'], post_type)
-		fieldnames = self.get_fieldnames(post_type)
-		self.save_data(data, filename, fieldnames)
 
+		await governor.acquire_async(url)
+		start = time.time()
+		try:
+			async with session.get(url, params=params) as res:
+				if res.status != 200:
+					self._report(url, res.status, time.time() - start)
+					return None
+				# Data is a list of dicts
+				data = (await res.json(content_type=None))['data']
+				self._report(url, res.status, time.time() - start)
+		except (aiohttp.ClientError, asyncio.TimeoutError, ProxyError, ProxyConnectionError, ProxyTimeoutError,
+				ValueError, KeyError, TypeError):
+			# Also not a Pushshift response, e.g. an HTML error page
+			self._report(url, None, time.time() - start)
+			return None
+		if self.cache is not None:
+			await run_blocking(self.cache.put, url, params, data)
 		return data
 
+	def _report(self, url, status, latency):
+		governor.report(url, status, latency)
+		metrics.inc('requests_total', platform=self.platform, status=status if status is not None else 'error')
+		metrics.observe('request_seconds', latency, platform=self.platform)
+
+	def _fetch_page(self, symbol, post_type, query_set, detect_cashtag, start_time, session, before=None):
+		"""Get a page of posts matching symbol and whether to save them, or None if the request failed.
+		"""
+		# Request
+		params = self._get_params('|'.join(query_set), start_time, post_type)
+		if before is not None:
+			params['before'] = before
+
+		if session is None:
+			raise Exception('Session is unspecified.')
+
+		url = self.url.format(post_type)
+		data = self._request(session, url, params)
+		if data is None:
+			return None, False
+		# print(json.dumps(data[0], indent=4, sort_keys=True))
+
+		if detect_cashtag:
+			return self._filter_cashtag(symbol, query_set, data)
+		return data, True
+
+	def _download_data(self, symbol, post_type, start_time=0, session=None):
+		query_set, detect_cashtag = self._get_query(symbol)
+		query = '|'.join(query_set)
+
+		# No query
+		if len(query) == 0:
+			print('\tNo query {}|{}|{}'.format(symbol['symbol'], symbol['shortName'], symbol['longName']))
+			return []
+		# if post_type == 'comment':
+		print('\t{}'.format(query), '==', '{}|{}|{}'.format(symbol['symbol'], symbol['shortName'], symbol['longName']))
+
+		data, save = self._fetch_page(symbol, post_type, query_set, detect_cashtag, start_time, session)
+		if data is None or not save:
+			return data
+		return self._save_page(symbol['symbol'], post_type, data)
+
+	async def _download_data_async(self, symbol, post_type, start_time=0, session=None):
+		"""Coroutine version of `_download_data` using an aiohttp session.
+		"""
+		query_set, detect_cashtag = self._get_query(symbol)
+		query = '|'.join(query_set)
+
+		# No query
+		if len(query) == 0:
+			print('\tNo query {}|{}|{}'.format(symbol['symbol'], symbol['shortName'], symbol['longName']))
+			return []
+
+		# Request
+		params = self._get_params(query, start_time, post_type)
+		params = {k: str(v) for k, v in params.items()}
+
+		if session is None:
+			raise Exception('Session is unspecified.')
+
+		url = self.url.format(post_type)
+		data = await self._request_async(session, url, params)
+		if data is None:
+			return None
+
+		if detect_cashtag:
+			data, save = self._filter_cashtag(symbol, query_set, data)
+			if not save:
+				return data
+		return await run_blocking(self._save_page, symbol['symbol'], post_type, data)
+
 	def download_data(self, symbol, post_type, worker_id=None, verbose=True):
-		session = tor.get_tor_session(renew=True)
+		# Start from last time saved
+		last_time = self.get_start_time(symbol['symbol'], post_type)
+		if verbose:
+			print('{}: Reddit start {} {} {}'.format(
+				worker_id,
+				symbol['symbol'],
+				post_type,
+				last_time))
+
+		with tor.circuit() as circuit:
+			# Run until CSV is up-to-date
+			while True:
+				# Get data
+				data = self._download_data(symbol, post_type, last_time, circuit.session)
+
+				# Data is none if request failed to fetch data
+				if data is None:
+					tor.fail(circuit)
+					continue
+
+				# CSV is up-to-date
+				if len(data) == 0:
+					self.manifest.check(self.platform, symbol['symbol'], post_type)
+					if verbose:
+						print('{}: Reddit done {} {} {}'.format(
+							worker_id,
+							symbol['symbol'],
+							post_type,
+							last_time))
+					break
+
+				# Set latest time
+				last_time = data[-1]['created_utc']
 
-		# Start from last time in CSV
-		filename = self.get_filename(symbol['symbol'], post_type)
-		last_time = 0;
-		if os.path.isfile(filename):
-			last_time = self.get_last_time(filename)
+				if verbose:
+					print('{}: Reddit got {} {} {} - {}'.format(
+						worker_id,
+						symbol['symbol'],
+						post_type,
+						datetime.fromtimestamp(data[0]['created_utc']),
+						datetime.fromtimestamp(last_time)))
+
+	def work(self, jobs, worker_id):
+		while not jobs.empty():
+			kwargs = jobs.get()
+			metrics.set_state(self.platform, worker_id, '{} {}'.format(kwargs['symbol']['symbol'], kwargs['post_type']))
+			try:
+				self.download_data(**kwargs, worker_id=worker_id)
+			except Exception:
+				# Workers stop on errors, e.g. of the writer; skip the jobs left so that join returns
+				drain_queue(jobs)
+				raise
+			finally:
+				jobs.task_done()
+		metrics.set_state(self.platform, worker_id, 'idle')
+
+	def update(self, budget=None):
+		"""Update symbols, the most active first, within an estimated budget of requests.
+		"""
+		candidates = []
+		symbols = get_symbols()
+		for symbol in symbols:
+			if symbol['symbol'][0] >= START_FROM:
+				for post_type in ['submission', 'comment']:
+					candidates.append(((symbol['symbol'], post_type), {'symbol':symbol, 'post_type':post_type}))
+		states = self.manifest.get_all(self.platform)
+		planned = PriorityScheduler(budget).plan(candidates, states)
+		print('Reddit planned {} of {} jobs'.format(len(planned), len(candidates)))
+
+		jobs = Queue()
+		for job in planned:
+			jobs.put(job)
+		metrics.set_func('queue_depth', jobs.qsize, platform=self.platform, queue='jobs')
+		for worker_id in range(NUM_WORKERS):
+			worker = threading.Thread(target=self.work, args=[jobs, worker_id])
+			worker.start()
+		jobs.join()
+		self.close()
+		print('Reddit update complete')
+
+	def refresh(self, symbol, post_type, batch_size=REFRESH_BATCH_SIZE, worker_id=None, verbose=True):
+		"""Fetch current engagement of saved posts of symbol by id, into its engagement csv.
+		"""
+		data = self.read_data(symbol, post_type, columns=['id'])
+		if data is None or len(data) == 0:
+			return 0
+		ids = list(dict.fromkeys(str(i) for i in data['id'].dropna()))
+		fields = ENGAGEMENT_FIELDS[self.get_search_type(post_type)]
+		url = self.url.format(self.get_search_type(post_type))
+		if verbose:
+			print('{}: Reddit refresh start {} {} {} posts'.format(worker_id, symbol, post_type, len(ids)))
+
+		rows = []
+		refreshed_utc = int(time.time())
+		with tor.circuit() as circuit:
+			for i in range(0, len(ids), batch_size):
+				batch = ids[i:i + batch_size]
+				params = {'ids': ','.join(batch), 'size': len(batch), 'fields': ','.join(['id'] + fields)}
+				while True:
+					# Engagement is never settled, so skip the cache
+					posts = self._request(circuit.session, url, params, cache=False)
+					if posts is not None:
+						break
+					tor.fail(circuit)
+				for post in posts:
+					rows.append([post.get('id'), refreshed_utc] + [post.get(field) for field in fields])
+
+		# Replace the previous refresh at once
+		filename = self.get_engagement_filename(symbol, post_type)
+		os.makedirs(os.path.dirname(filename), exist_ok=True)
+		tmp_filename = filename + '.tmp'
+		with open(tmp_filename, 'w', encoding='utf-8', newline='') as f:
+			writer = csv.writer(f, delimiter=self.delimiter)
+			writer.writerow(['id', 'refreshed_utc'] + fields)
+			writer.writerows(rows)
+		os.replace(tmp_filename, filename)
+		metrics.inc('refreshed_total', len(rows), platform=self.platform, post_type=post_type)
+		if verbose:
+			print('{}: Reddit refresh done {} {} {} of {} posts'.format(worker_id, symbol, post_type, len(rows), len(ids)))
+		return len(rows)
+
+	def work_refresh(self, jobs, worker_id):
+		while not jobs.empty():
+			kwargs = jobs.get()
+			metrics.set_state(self.platform, worker_id, 'refresh {} {}'.format(kwargs['symbol'], kwargs['post_type']))
+			try:
+				self.refresh(**kwargs, worker_id=worker_id)
+			except Exception:
+				# Workers stop on errors, e.g. of the writer; skip the jobs left so that join returns
+				drain_queue(jobs)
+				raise
+			finally:
+				jobs.task_done()
+		metrics.set_state(self.platform, worker_id, 'idle')
+
+	def update_refresh(self):
+		"""Refresh engagement of all saved posts, a few hundred ids per request.
+		"""
+		jobs = Queue()
+		for (symbol, post_type), state in self.manifest.get_all(self.platform).items():
+			if state['row_count']:
+				jobs.put({'symbol': symbol, 'post_type': post_type})
+		print('Reddit refresh {} jobs'.format(jobs.qsize()))
+		metrics.set_func('queue_depth', jobs.qsize, platform=self.platform, queue='jobs')
+		for worker_id in range(NUM_WORKERS):
+			worker = threading.Thread(target=self.work_refresh, args=[jobs, worker_id])
+			worker.start()
+		jobs.join()
+		print('Reddit refresh complete')
+
+	def get_window_filename(self, window):
+		symbol, post_type = window.job
+		return os.path.join(self.directory, WINDOW_DIR, '{}_{}{}_{}.jsonl'.format(fs_encode(symbol), post_type, self.suffix, window.after))
+
+	def download_window(self, symbol, window, scheduler, circuit, worker_id=None, verbose=True):
+		"""Download one time window of a job into its own part file.
+		"""
+		post_type = window.job[1]
+		query_set, detect_cashtag = self._get_query(symbol)
+		filename = self.get_window_filename(window)
+		with open(filename, 'w', encoding='utf-8') as f:
+			while len(query_set) > 0:
+				data, save = self._fetch_page(symbol, post_type, query_set, detect_cashtag, window.cursor, circuit.session, window.before)
+
+				# Data is none if request failed to fetch data
+				if data is None:
+					tor.fail(circuit)
+					continue
+
+				# Drop posts of a window split off while requesting
+				data, done = scheduler.advance(window, data)
+				if save:
+					for post in data:
+						f.write(json.dumps(post))
+						f.write('\n')
+
+				if verbose and len(data) > 0:
+					print('{}: Reddit got {} {} {} - {}'.format(
+						worker_id,
+						symbol['symbol'],
+						post_type,
+						datetime.fromtimestamp(data[0]['created_utc']),
+						datetime.fromtimestamp(data[-1]['created_utc'])))
+				if done:
+					break
+
+		# Last window of job merges all windows in order
+		windows = scheduler.finish(window)
+		if windows is not None:
+			self._merge_windows(symbol['symbol'], post_type, windows)
+			if verbose:
+				print('{}: Reddit done {} {} ({} windows)'.format(
+					worker_id,
+					symbol['symbol'],
+					post_type,
+					len(windows)))
+
+	def _merge_windows(self, symbol, post_type, windows, page_size=500):
+		for window in windows:
+			filename = self.get_window_filename(window)
+			with open(filename, 'r', encoding='utf-8') as f:
+				data = []
+				for line in f:
+					data.append(json.loads(line))
+					if len(data) >= page_size:
+						self._save_page(symbol, post_type, data)
+						data = []
+				if len(data) > 0:
+					self._save_page(symbol, post_type, data)
+			os.remove(filename)
+
+	def work_windows(self, scheduler, symbols, worker_id):
+		with tor.circuit() as circuit:
+			while True:
+				window = scheduler.next()
+				if window is None:
+					break
+				metrics.set_state(self.platform, worker_id, '{} {} {}'.format(*window.job, window.after))
+				self.download_window(symbols[window.job[0]], window, scheduler, circuit, worker_id)
+		metrics.set_state(self.platform, worker_id, 'idle')
+
+	def update_windows(self, min_span=WINDOW_MIN_SPAN):
+		"""Update with jobs split into time windows, so idle workers help with large jobs.
+		"""
+		scheduler = WindowScheduler(min_span)
+		before = int(time.time())
+		window_dir = os.path.join(self.directory, WINDOW_DIR)
+		shutil.rmtree(window_dir, ignore_errors=True)
+		os.makedirs(window_dir)
+
+		symbols = {}
+		for symbol in get_symbols():
+			if symbol['symbol'][0] >= START_FROM:
+				symbols[symbol['symbol']] = symbol
+				for post_type in ['submission', 'comment']:
+					after = self.get_start_time(symbol['symbol'], post_type)
+					scheduler.add_job((symbol['symbol'], post_type), after, before)
+
+		workers = []
+		for worker_id in range(NUM_WORKERS):
+			worker = threading.Thread(target=self.work_windows, args=[scheduler, symbols, worker_id])
+			worker.start()
+			workers.append(worker)
+		for worker in workers:
+			worker.join()
+		self.close()
+		print('Reddit update complete')
+
+	def _get_routes(self, symbols):
+		"""Get query terms of all symbols for routing posts locally.
+		"""
+		routes = []
+		for symbol in symbols:
+			query_set, detect_cashtag = self._get_query(symbol)
+			if len(query_set) == 0:
+				continue
+			# First query term is the symbol, if it was added
+			if detect_cashtag or len(symbol['symbol']) > 1:
+				term, names = query_set[0].lower(), query_set[1:]
+			else:
+				term, names = None, query_set
+			routes.append((symbol, term, names, detect_cashtag))
+		return routes
+
+	def get_matcher(self, symbols=None):
+		"""Compile the query terms of symbols into one matcher.
+		"""
+		if symbols is None:
+			symbols = get_symbols()
+		return SymbolMatcher(self._get_routes(symbols))
+
+	def crawl(self, post_type, verbose=True):
+		"""Page through the subreddit once and save each post under every symbol it matches.
+		"""
+		matcher = self.get_matcher()
+
+		# Start from last crawled time
+		crawl_platform = '{}_crawl'.format(self.platform)
+		state = self.manifest.get(crawl_platform, '', post_type)
+		last_time = state['last_time'] if state is not None else 0
+
+		# Skip posts already saved by a per-symbol update
+		symbol_times = {}
+		def get_symbol_time(symbol):
+			if symbol not in symbol_times:
+				symbol_times[symbol] = self.get_start_time(symbol, post_type)
+			return symbol_times[symbol]
+
+		if verbose:
+			print('Reddit crawl start {} {} {}'.format(self.subreddit, post_type, last_time))
+
+		# Pages routed and not yet written, as [last_time, last_id, pending writes]
+		pages = []
+		pages_lock = threading.Lock()
+		def on_write(page):
+			# Save the cursor of pages written in full, including all pages before them
+			with pages_lock:
+				page[2] -= 1
+				written = None
+				while len(pages) > 0 and pages[0][2] == 0:
+					written = pages.pop(0)
+				if written is not None:
+					self.manifest.set(crawl_platform, '', post_type, written[0], written[1])
+
+		metrics.set_state(self.platform, 'crawl', post_type)
+		url = self.url.format(post_type)
+		params = self._get_params(None, last_time, post_type)
+		with tor.circuit() as circuit:
+			while True:
+				params['after'] = last_time
+				data = self._request(circuit.session, url, params)
+				if data is None:
+					tor.fail(circuit)
+					continue
+
+				if len(data) == 0:
+					break
+
+				last_time = data[-1]['created_utc']
+				# Held until the page is routed
+				page = [last_time, data[-1].get('id'), 1]
+				with pages_lock:
+					pages.append(page)
+
+				routed = matcher.route(data)
+				for symbol, posts in routed.items():
+					symbol_time = get_symbol_time(symbol)
+					posts = [post for post in posts if post['created_utc'] > symbol_time]
+					if len(posts) > 0:
+						with pages_lock:
+							page[2] += 1
+						self._save_posts(symbol, post_type, posts, functools.partial(on_write, page))
+				on_write(page)
+
+				if verbose:
+					print('Reddit crawl got {} {} {} - {} ({} symbols)'.format(
+						post_type,
+						len(data),
+						datetime.fromtimestamp(data[0]['created_utc']),
+						datetime.fromtimestamp(last_time),
+						len(routed)))
+
+		if verbose:
+			print('Reddit crawl done {} {} {}'.format(self.subreddit, post_type, last_time))
+
+	def update_crawl(self):
+		"""Update all symbols with one pass over the subreddit per post type.
+		"""
+		for post_type in ['submission', 'comment']:
+			self.crawl(post_type)
+		self.close()
+		print('Reddit update complete')
+
+	async def download_data_async(self, symbol, post_type, circuit, worker_id=None, verbose=True):
+		# Start from last time saved, which may read a whole CSV to seed the manifest
+		last_time = await run_blocking(self.get_start_time, symbol['symbol'], post_type)
 		if verbose:
 			print('{}: Reddit start {} {} {}'.format(
 				worker_id,
@@ -444,14 +1286,17 @@ class REDDIT:
 		# Run until CSV is up-to-date
 		while True:
 			# Get data
-			data = self._download_data(symbol, post_type, last_time, session)
+			session = circuit.session
+			data = await self._download_data_async(symbol, post_type, last_time, session)
 
 			# Data is none if request failed to fetch data
 			if data is None:
+				await circuit.fail(session)
 				continue
 
 			# CSV is up-to-date
 			if len(data) == 0:
+				await run_blocking(self.manifest.check, self.platform, symbol['symbol'], post_type)
 				if verbose:
 					print('{}: Reddit done {} {} {}'.format(
 						worker_id,
@@ -471,43 +1316,214 @@ class REDDIT:
 					datetime.fromtimestamp(data[0]['created_utc']),
 					datetime.fromtimestamp(last_time)))
 
-	def work(self, jobs, worker_id):
+	async def work_async(self, jobs, circuit, worker_id):
 		while not jobs.empty():
-			kwargs = jobs.get()
-			self.download_data(**kwargs, worker_id=worker_id)
+			kwargs = jobs.get_nowait()
+			metrics.set_state(self.platform, worker_id, '{} {}'.format(kwargs['symbol']['symbol'], kwargs['post_type']))
+			await self.download_data_async(**kwargs, circuit=circuit, worker_id=worker_id)
 			jobs.task_done()
+		metrics.set_state(self.platform, worker_id, 'idle')
 
-	def update(self):
-		jobs = Queue()
+	def _get_circuits(self, concurrency):
+		"""Get aiohttp sessions for concurrency workers, a few connection pools each on its own tor circuit.
+		"""
+		circuits = tor.get_circuits(min(tor.size, concurrency))
+		limit = math.ceil(concurrency / len(circuits))
+		timeout = aiohttp.ClientTimeout(total=120)
+		return [AsyncCircuit(c, limit, timeout) for c in circuits]
+
+	async def _update_async(self, budget, concurrency):
+		candidates = []
 		symbols = get_symbols()
 		for symbol in symbols:
 			if symbol['symbol'][0] >= START_FROM:
-				jobs.put({'symbol':symbol, 'post_type':'submission'})
-				jobs.put({'symbol':symbol, 'post_type':'comment'})
-		for worker_id in range(NUM_WORKERS):
-			worker = threading.Thread(target=self.work, args=[jobs, worker_id])
-			worker.start()
-		jobs.join()
+				for post_type in ['submission', 'comment']:
+					candidates.append(((symbol['symbol'], post_type), {'symbol':symbol, 'post_type':post_type}))
+		states = self.manifest.get_all(self.platform)
+		planned = PriorityScheduler(budget).plan(candidates, states)
+		print('Reddit planned {} of {} jobs'.format(len(planned), len(candidates)))
+
+		jobs = asyncio.Queue()
+		for job in planned:
+			jobs.put_nowait(job)
+		metrics.set_func('queue_depth', jobs.qsize, platform=self.platform, queue='jobs')
+
+		circuits = self._get_circuits(concurrency)
+		try:
+			workers = [self.work_async(jobs, circuits[worker_id % len(circuits)], worker_id) for worker_id in range(concurrency)]
+			await asyncio.gather(*workers)
+		finally:
+			for circuit in circuits:
+				await circuit.close()
+
+	def update_async(self, budget=None, concurrency=NUM_CONNECTIONS):
+		"""Run planned jobs in one event loop with at most `concurrency` requests in flight.
+		"""
+		asyncio.run(self._update_async(budget, concurrency))
+		self.close()
 		print('Reddit update complete')
 
-def update_twitter():
+	async def _fetch_thread_comments(self, link_ids, after, session):
+		"""Get a page of comments under the submissions link_ids, or None if the request failed.
+		"""
+		params = self._get_params(None, after, 'comment')
+		params['link_id'] = ','.join('t3_{}'.format(i) for i in link_ids)
+		params = {k: str(v) for k, v in params.items()}
+		return await self._request_async(session, self.url.format('comment'), params)
+
+	async def harvest_threads(self, symbol, circuit, batch_size=THREAD_BATCH_SIZE, worker_id=None, verbose=True):
+		"""Save the comments of settled submissions of symbol, fetched by link_id a batch of threads at a time.
+		"""
+		state = await run_blocking(self.manifest.get, self.platform, symbol, 'thread_comment')
+		since = state['last_time'] if state is not None and state['last_time'] is not None else 0
+		submissions = await run_blocking(functools.partial(self.read_data, symbol, 'submission', columns=['created_utc', 'id']))
+		if submissions is None:
+			return
+		settled = time.time() - THREAD_SETTLE
+		submissions = submissions[(submissions['created_utc'] > since) & (submissions['created_utc'] < settled)]
+		submissions = submissions.sort_values('created_utc', kind='stable').drop_duplicates('id')
+		if verbose:
+			print('{}: Reddit threads start {} {} threads'.format(worker_id, symbol, len(submissions)))
+
+		filename = self.get_filename(symbol, 'thread_comment')
+		fieldnames = self.get_fieldnames('thread_comment')
+		for i in range(0, len(submissions), batch_size):
+			batch = submissions.iloc[i:i + batch_size]
+			link_ids = [str(link_id) for link_id in batch['id']]
+			after = 0
+			while True:
+				session = circuit.session
+				data = await self._fetch_thread_comments(link_ids, after, session)
+				# Data is none if request failed to fetch data
+				if data is None:
+					await circuit.fail(session)
+					continue
+				if len(data) == 0:
+					break
+				after = data[-1]['created_utc']
+				# Until the batch is done, resume from the batch before it
+				callback = functools.partial(self._record_threads, symbol, since, data[0]['created_utc'], len(data))
+				await run_blocking(self.save_data, data, filename, fieldnames, callback)
+
+			# Mark the batch done once all its comments are written
+			since = int(batch['created_utc'].iloc[-1])
+			await run_blocking(self.save_data, [], filename, fieldnames, functools.partial(self._record_threads, symbol, since, None, 0))
+			if verbose:
+				print('{}: Reddit threads got {} {} - {}'.format(
+					worker_id,
+					symbol,
+					datetime.fromtimestamp(batch['created_utc'].iloc[0]),
+					datetime.fromtimestamp(since)))
+		await run_blocking(self.manifest.check, self.platform, symbol, 'thread_comment')
+
+	def _record_threads(self, symbol, last_time, first_time, rows, nbytes):
+		# last_time of thread comments is that of the last harvested submission
+		self.manifest.add(self.platform, symbol, 'thread_comment', last_time, None, rows, nbytes, first_time)
+		metrics.inc('posts_total', rows, platform=self.platform, post_type='thread_comment')
+		metrics.inc('bytes_total', nbytes, platform=self.platform, post_type='thread_comment')
+
+	async def work_threads(self, jobs, circuit, worker_id):
+		while not jobs.empty():
+			symbol = jobs.get_nowait()
+			metrics.set_state(self.platform, worker_id, 'threads {}'.format(symbol))
+			await self.harvest_threads(symbol, circuit, worker_id=worker_id)
+			jobs.task_done()
+		metrics.set_state(self.platform, worker_id, 'idle')
+
+	async def _update_threads(self, concurrency):
+		jobs = asyncio.Queue()
+		for (symbol, post_type), state in self.manifest.get_all(self.platform).items():
+			if post_type == 'submission' and state['row_count']:
+				jobs.put_nowait(symbol)
+		print('Reddit threads {} jobs'.format(jobs.qsize()))
+		metrics.set_func('queue_depth', jobs.qsize, platform=self.platform, queue='jobs')
+
+		circuits = self._get_circuits(concurrency)
+		try:
+			workers = [self.work_threads(jobs, circuits[worker_id % len(circuits)], worker_id) for worker_id in range(concurrency)]
+			await asyncio.gather(*workers)
+		finally:
+			for circuit in circuits:
+				await circuit.close()
+
+	def update_threads(self, concurrency=NUM_WORKERS):
+		"""Harvest the comment threads of saved submissions of all symbols with at most `concurrency` requests in flight.
+		"""
+		if self.storage != 'csv':
+			raise Exception('Thread comments are only saved to csv.')
+		asyncio.run(self._update_threads(concurrency))
+		self.close()
+		print('Reddit threads complete')
+
+def update_twitter(budget=None, use_async=False):
 	twitter = TWITTER(directory='twitter_data')
-	twitter.update()
+	if use_async:
+		twitter.update_async(budget)
+	else:
+		twitter.update(budget=budget)
 
-def update_reddit():
+def build_query_table():
 	reddit = REDDIT(directory='reddit_data', subreddit='wallstreetbets')
-	reddit.update()
+	reddit.build_query_table()
+	print('Query table built')
+
+def update_reddit(use_async=False, use_crawl=False, storage='csv', use_windows=False, use_cache=False, budget=None,
+		profile='full', use_refresh=False, use_threads=False):
+	reddit = REDDIT(directory='reddit_data', subreddit='wallstreetbets', storage=storage, cache=use_cache, profile=profile)
+	if use_refresh:
+		reddit.update_refresh()
+	elif use_threads:
+		reddit.update_threads()
+	elif use_crawl:
+		reddit.update_crawl()
+	elif use_windows:
+		reddit.update_windows()
+	elif use_async:
+		reddit.update_async(budget)
+	else:
+		reddit.update(budget)
 
 if __name__ == '__main__':
 	opts = [opt for opt in sys.argv[1:] if opt.startswith("-")]
-
-	if "-t" in opts:
-		update_twitter()
+	use_async = "--async" in opts
+	use_crawl = "--crawl" in opts
+	use_windows = "--split" in opts
+	use_cache = "--cache" in opts
+	use_refresh = "--refresh" in opts
+	use_threads = "--threads" in opts
+	storage = 'csv'
+	if "--parquet" in opts:
+		storage = 'parquet'
+	elif "--store" in opts:
+		storage = 'store'
+	budget = None
+	profile = 'full'
+	for opt in opts:
+		if opt.startswith('--budget='):
+			budget = int(opt.split('=', 1)[1])
+		elif opt.startswith('--profile='):
+			profile = opt.split('=', 1)[1]
+		elif opt.startswith('--metrics='):
+			metrics.serve(int(opt.split('=', 1)[1]))
+			metrics.start_snapshots(METRICS_SNAPSHOT)
+
+	if "-q" in opts:
+		build_query_table()
+	elif "-t" in opts:
+		update_twitter(budget, use_async)
 	elif "-r" in opts:
-		update_reddit()
+		update_reddit(use_async, use_crawl, storage, use_windows, use_cache, budget, profile, use_refresh, use_threads)
 	elif "-a" in opts:
-		update_twitter()
-		update_reddit()
+		update_twitter(budget, use_async)
+		update_reddit(use_async, use_crawl, storage, use_windows, use_cache, budget, profile, use_refresh, use_threads)
 	else:
 		print('Please specify a platform to download.\n' +
-			'Twitter: `-t`, Reddit: `-r`, all: `-a`')
+			'Twitter: `-t`, Reddit: `-r`, all: `-a`, build query table: `-q`\n' +
+			'Reddit and Twitter with asyncio: `--async`, single pass over the subreddit: `--crawl`, ' +
+			'time windows split between workers: `--split`, cache responses on disk: `--cache`, ' +
+			'refresh scores of saved posts by id: `--refresh`, ' +
+			'comments of saved submissions by thread: `--threads`, ' +
+			'Parquet storage: `--parquet`, deduplicated post store: `--store`, ' +
+			'limit requests of an update: `--budget=<requests>`, ' +
+			'fields to download: `--profile=<{}>`, '.format('|'.join(['full'] + list(FIELD_PROFILES))) +
+			'serve metrics on localhost: `--metrics=<port>`')
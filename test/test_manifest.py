@@ -0,0 +1,89 @@
+import os
+from datetime import datetime
+
+from manifest import Manifest
+
+
+def test_add_accumulates_pages(tmp_path):
+	manifest = Manifest(str(tmp_path / 'manifest.sqlite'))
+	assert manifest.get('reddit', 'GME', 'comment') is None
+	manifest.add('reddit', 'GME', 'comment', 1000, 'a', 10, 100, first_time=500)
+	manifest.add('reddit', 'GME', 'comment', 2000, 'b', 20, 300, first_time=1500)
+	state = manifest.get('reddit', 'GME', 'comment')
+	assert (state['last_time'], state['last_id'], state['row_count'], state['byte_size']) == (2000, 'b', 30, 400)
+	assert state['first_time'] == 500
+	assert state['pages'] == 2
+	assert state['recent_rate'] == 20 / 1000
+
+def test_resume_after_reopen(tmp_path):
+	filename = str(tmp_path / 'data' / 'manifest.sqlite')
+	manifest = Manifest(filename)
+	manifest.add('reddit', 'GME', 'submission', 1000, 'a', 10, 100)
+	manifest.add('twitter', 'GME', 'tweet', 3000, None, 5, 50)
+	manifest.close()
+
+	manifest = Manifest(filename)
+	assert manifest.get('reddit', 'GME', 'submission')['last_time'] == 1000
+	states = manifest.get_all('reddit')
+	assert list(states) == [('GME', 'submission')]
+	assert states[('GME', 'submission')]['last_id'] == 'a'
+
+def test_check_keeps_cursor(tmp_path):
+	manifest = Manifest(str(tmp_path / 'manifest.sqlite'))
+	manifest.check('twitter', 'GME', 'tweet')
+	state = manifest.get('twitter', 'GME', 'tweet')
+	assert state['last_time'] is None and state['checked_at'] is not None
+
+	manifest.add('twitter', 'GME', 'tweet', 1000, None, 5, 50)
+	manifest.check('twitter', 'GME', 'tweet')
+	state = manifest.get('twitter', 'GME', 'tweet')
+	assert (state['last_time'], state['row_count'], state['pages']) == (1000, 5, 1)
+
+def test_older_page_keeps_recent_rate(tmp_path):
+	manifest = Manifest(str(tmp_path / 'manifest.sqlite'))
+	manifest.add('reddit', 'GME', 'comment', 1000, 'a', 10, 100)
+	manifest.add('reddit', 'GME', 'comment', 1100, 'b', 10, 100)
+	manifest.add('reddit', 'GME', 'comment', 1100, 'c', 10, 100)
+	assert manifest.get('reddit', 'GME', 'comment')['recent_rate'] == 0.1
+
+def test_set_replaces_state(tmp_path):
+	manifest = Manifest(str(tmp_path / 'manifest.sqlite'))
+	manifest.add('reddit', 'GME', 'comment', 1000, 'a', 10, 100)
+	manifest.set('reddit', 'GME', 'comment', 500, 'z', 1, 10)
+	state = manifest.get('reddit', 'GME', 'comment')
+	assert (state['last_time'], state['last_id'], state['row_count'], state['pages']) == (500, 'z', 1, None)
+
+def write_tweets(filename, rows):
+	header = not os.path.exists(filename)
+	with open(filename, 'a', encoding='utf-8') as f:
+		if header:
+			f.write('id,date,time,tweet\n')
+		for tweet_id, date in rows:
+			f.write('{},{},{},text\n'.format(tweet_id, date.strftime('%Y-%m-%d'), date.strftime('%H:%M:%S')))
+
+def test_twitter_resumes_after_newest_saved_tweet(tmp_path, monkeypatch):
+	import scrape_social
+	monkeypatch.chdir(tmp_path)
+	twitter = scrape_social.TWITTER('twitter_data')
+	symbol = {'symbol': 'GME'}
+	filename = twitter.get_filename('GME')
+	os.makedirs(os.path.dirname(filename))
+
+	write_tweets(filename, [(2, datetime(2021, 1, 4, 0, 5)), (1, datetime(2021, 1, 3, 12, 0))])
+	twitter._record_search(symbol, None)
+	state = twitter.manifest.get('twitter', 'GME', 'tweet')
+	assert datetime.fromtimestamp(state['last_time']) == datetime(2021, 1, 4, 0, 5)
+	assert datetime.fromtimestamp(state['first_time']) == datetime(2021, 1, 3, 12, 0)
+	assert (state['row_count'], state['byte_size']) == (2, os.path.getsize(filename))
+	_, _, last_date = twitter._get_search(symbol, datetime(2021, 1, 1), datetime(2021, 2, 1))
+	assert last_date == datetime(2021, 1, 4, 0, 5)
+
+	# A search without new rows only records the check
+	twitter._record_search(symbol, state)
+	checked = twitter.manifest.get('twitter', 'GME', 'tweet')
+	assert checked['last_time'] == state['last_time'] and checked['checked_at'] is not None
+
+	# A failed search leaves the cursor, so the next one covers the same time
+	write_tweets(filename, [(3, datetime(2021, 1, 5))])
+	twitter._record_search(symbol, checked, error='TimeoutError()')
+	assert twitter.manifest.get('twitter', 'GME', 'tweet') == checked
@@ -0,0 +1,64 @@
+import random
+
+from matcher import SymbolMatcher, TEXT_ATTRS, tokenize
+
+
+def brute_force(routes, text):
+	"""Match text against each route on its own.
+	"""
+	text = text.lower()
+	words = tokenize(text)
+	found = set()
+	for symbol, term, names, detect_cashtag in routes:
+		if any(name.lower() in text for name in names):
+			found.add(symbol)
+		elif term is not None and (term in words or (not detect_cashtag and '${}'.format(term) in words)):
+			found.add(symbol)
+	return found
+
+ROUTES = [
+	('ALL', '$all', ['allstate corp', 'allstate'], True),
+	('AAPL', 'aapl', ['apple inc', 'apple'], False),
+	('GME', 'gme', ['gamestop'], False),
+	('GM', 'gm', ['general motors'], False),
+	('X', None, ['united states steel'], False),
+	('PLE', 'ple', ['pineapple'], False),
+]
+WORDS = ['all', '$all', 'ALL', '$ALL.', 'allstate', 'AllState corp', 'tall', 'apple', 'pineapple', 'aapl', '$AAPL,',
+	'gme', '$gme;', 'gamestop', 'gm', '$gm', 'general', 'motors', 'General Motors', 'united states steel', 'x', 'ple']
+
+def test_match():
+	matcher = SymbolMatcher(ROUTES)
+	assert matcher.match('Buying $ALL today') == {'ALL'}
+	assert matcher.match('all in') == set()
+	assert matcher.match('Apple and $AAPL.') == {'AAPL'}
+	assert matcher.match('pineapple') == {'AAPL', 'PLE'}
+	assert matcher.match('GME,GM') == {'GME', 'GM'}
+
+def test_match_agrees_with_brute_force():
+	matcher = SymbolMatcher(ROUTES)
+	rng = random.Random(0)
+	for _ in range(5000):
+		text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 6)))
+		assert matcher.match(text) == brute_force(ROUTES, text), text
+
+def test_route_keeps_post_order():
+	matcher = SymbolMatcher(ROUTES)
+	posts = [
+		{'title': 'GameStop', 'selftext': 'and apple'},
+		{'body': 'nothing'},
+		{'body': '$gme'},
+		{'title': None, 'body': 'gm'},
+	]
+	assert matcher.match_posts(posts) == [{'GME', 'AAPL'}, set(), {'GME'}, {'GM'}]
+	assert matcher.route(posts) == {'GME': [posts[0], posts[2]], 'AAPL': [posts[0]], 'GM': [posts[3]]}
+
+def test_match_post_agrees_with_brute_force():
+	matcher = SymbolMatcher(ROUTES)
+	rng = random.Random(1)
+	for _ in range(1000):
+		post = {attr: ' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 4))) for attr in rng.sample(TEXT_ATTRS, 2)}
+		expected = set()
+		for text in post.values():
+			expected |= brute_force(ROUTES, text)
+		assert matcher.match_post(post) == expected, post
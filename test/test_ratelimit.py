@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+from ratelimit import RateGovernor
+
+URL = 'https://api.pushshift.io/reddit/search/comment'
+
+
+class Clock:
+	def __init__(self):
+		self.now = 1000.0
+
+	def __call__(self):
+		return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+	clock = Clock()
+	monkeypatch.setattr(time, 'monotonic', clock)
+	return clock
+
+def get_limit(governor):
+	return governor._limits[URL]
+
+def test_success_increases_rate(clock):
+	governor = RateGovernor(rate=4.0, increase=0.5)
+	governor.report(URL, 200, 0.1)
+	assert get_limit(governor).rate == pytest.approx(4.125)
+	for _ in range(10000):
+		governor.report(URL, 200, 0.1)
+	assert get_limit(governor).rate == governor.max_rate
+
+def test_throttle_cuts_rate_and_blocks(clock):
+	governor = RateGovernor(rate=4.0, decrease=0.5, cooldown=2.0, backoff=1.0)
+	governor.report(URL, 429, 0.1)
+	limit = get_limit(governor)
+	assert limit.rate == 2.0
+	assert limit.blocked_until == clock.now + 1.0
+	assert governor._reserve(URL) == pytest.approx(1.0)
+
+	# Failures within the cooldown back off longer without cutting the rate again
+	governor.report(URL, 503, 0.1)
+	assert limit.rate == 2.0
+	assert limit.blocked_until == clock.now + 2.0
+	clock.now += 3
+	governor.report(URL, None, 0.1)
+	assert limit.rate == 1.0
+	assert limit.blocked_until == clock.now + 4.0
+	assert (limit.throttled, limit.errors) == (2, 1)
+
+def test_rate_and_backoff_are_bounded(clock):
+	governor = RateGovernor(rate=4.0, min_rate=0.5, cooldown=0, max_backoff=30.0)
+	for _ in range(20):
+		clock.now += 1
+		governor.report(URL, 429, 0.1)
+	limit = get_limit(governor)
+	assert limit.rate == 0.5
+	assert limit.blocked_until == clock.now + 30.0
+
+def test_client_errors_keep_rate(clock):
+	governor = RateGovernor(rate=4.0)
+	governor.report(URL, 404, 0.1)
+	limit = get_limit(governor)
+	assert limit.rate == 4.0
+	assert limit.blocked_until == 0
+	assert limit.errors == 1
+
+def test_recovery_after_backoff(clock):
+	governor = RateGovernor(rate=4.0, burst=1, decrease=0.5, backoff=1.0)
+	governor.report(URL, 429, 0.1)
+	governor.report(URL, 429, 0.1)
+	limit = get_limit(governor)
+	clock.now = limit.blocked_until
+	assert governor._reserve(URL) <= 0
+
+	governor.report(URL, 200, 0.1)
+	assert limit.consecutive_failures == 0
+	rate = limit.rate
+	for _ in range(20):
+		governor.report(URL, 200, 0.1)
+	assert limit.rate > rate
+	# The next failure starts from the shortest backoff again
+	clock.now += 10
+	governor.report(URL, 429, 0.1)
+	assert limit.blocked_until == clock.now + 1.0
+
+def test_tokens_pace_requests(clock):
+	governor = RateGovernor(rate=2.0, burst=2)
+	assert governor._reserve(URL) == 0
+	assert governor._reserve(URL) == 0
+	assert governor._reserve(URL) == pytest.approx(0.5)
+	# A second refills two tokens, one of them already reserved
+	clock.now += 1
+	assert governor._reserve(URL) == 0
+	assert governor._reserve(URL) == pytest.approx(0.5)
+
+def test_endpoints_are_independent(clock):
+	governor = RateGovernor(rate=4.0)
+	governor.report(URL, 429, 0.1)
+	assert governor._reserve('https://api.pushshift.io/reddit/search/submission') == 0
+	assert set(governor.get_stats()) == {URL, 'https://api.pushshift.io/reddit/search/submission'}
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+from response_cache import ResponseCache
+
+URL = 'https://api.pushshift.io/reddit/search/comment'
+NOW = 1600000000.0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+	now = [NOW]
+	monkeypatch.setattr(time, 'time', lambda: now[0])
+	return now
+
+def make_page(start, count):
+	return [{'id': str(i), 'created_utc': start + i} for i in range(count)]
+
+def test_hit_with_params_in_any_order(tmp_path, clock):
+	cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+	params = {'q': 'gme', 'after': 100, 'size': 500}
+	assert cache.get(URL, params) is None
+	page = make_page(100, 3)
+	cache.put(URL, params, page)
+	assert cache.get(URL, {'size': '500', 'after': '100', 'q': 'gme'}) == page
+	assert cache.get(URL, dict(params, after=101)) is None
+	assert (cache.hits, cache.misses) == (1, 2)
+
+def test_recent_page_expires_after_ttl(tmp_path, clock):
+	cache = ResponseCache(str(tmp_path / 'cache.sqlite'), ttl=3600, settle=86400)
+	params = {'after': 0, 'size': 3}
+	# Full, but its posts are still changing
+	cache.put(URL, params, make_page(int(NOW) - 100, 3))
+	clock[0] += 3599
+	assert cache.get(URL, params) is not None
+	clock[0] += 2
+	assert cache.get(URL, params) is None
+
+def test_settled_page_is_kept(tmp_path, clock):
+	cache = ResponseCache(str(tmp_path / 'cache.sqlite'), ttl=3600, settle=86400)
+	params = {'after': 0, 'size': 3}
+	cache.put(URL, params, make_page(int(NOW) - 2 * 86400, 3))
+	clock[0] += 365 * 86400
+	assert cache.get(URL, params) is not None
+
+def test_settled_rule(tmp_path, clock):
+	cache = ResponseCache(str(tmp_path / 'cache.sqlite'), settle=86400)
+	old = make_page(int(NOW) - 2 * 86400, 3)
+	assert cache.is_settled({'size': 3}, old)
+	# A partial page ends at the present, which may still get posts
+	assert not cache.is_settled({'size': 500}, old)
+	assert not cache.is_settled({}, old)
+	assert not cache.is_settled({'size': 3}, make_page(int(NOW) - 100, 3))
+	# A window that ended in the past is settled, even if empty
+	assert cache.is_settled({'size': 500, 'before': int(NOW) - 2 * 86400}, [])
+	assert not cache.is_settled({'size': 500, 'before': int(NOW)}, [])
+
+def test_kept_after_reopen(tmp_path, clock):
+	filename = str(tmp_path / 'data' / 'cache.sqlite')
+	cache = ResponseCache(filename)
+	params = {'after': 0, 'size': 3}
+	page = make_page(0, 3)
+	cache.put(URL, params, page)
+	cache.close()
+	assert ResponseCache(filename).get(URL, params) == page
+
+def test_evicts_least_recently_used(tmp_path, clock):
+	cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+	for after in range(3):
+		cache.put(URL, {'after': after, 'size': 3}, make_page(after, 3))
+		clock[0] += 1
+	cache.get(URL, {'after': 0, 'size': 3})
+	clock[0] += 1
+	# Room for about two pages
+	cache.max_bytes = cache._size * 3 // 4
+	cache.put(URL, {'after': 3, 'size': 3}, make_page(3, 3))
+	assert cache.get(URL, {'after': 0, 'size': 3}) is not None
+	assert cache.get(URL, {'after': 1, 'size': 3}) is None
+	assert cache.get(URL, {'after': 3, 'size': 3}) is not None
+	assert cache._size <= cache.max_bytes
@@ -0,0 +1,125 @@
+import random
+import threading
+
+from scheduler import WindowScheduler
+
+
+def fetch(posts, after, before, page_size):
+	"""Get a page of posts strictly between after and before, like Pushshift.
+	"""
+	return [post for post in posts if after < post['created_utc'] < before][:page_size]
+
+def run_workers(scheduler, posts, num_workers, page_size):
+	"""Download all windows with num_workers threads. Returns the merged posts of each job.
+	"""
+	merged = {}
+	kept = {}
+	lock = threading.Lock()
+
+	def work():
+		while True:
+			window = scheduler.next()
+			if window is None:
+				return
+			while True:
+				data = fetch(posts[window.job], window.cursor, window.before, page_size)
+				data, done = scheduler.advance(window, data)
+				with lock:
+					kept.setdefault(id(window), []).extend(data)
+				if done:
+					break
+			windows = scheduler.finish(window)
+			if windows is not None:
+				with lock:
+					merged[window.job] = [post for w in windows for post in kept.get(id(w), [])]
+
+	threads = [threading.Thread(target=work) for _ in range(num_workers)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join(30)
+		assert not thread.is_alive()
+	return merged
+
+def make_posts(rng, after, before, count):
+	return [{'created_utc': t} for t in sorted(rng.sample(range(after + 1, before), count))]
+
+def test_single_window():
+	scheduler = WindowScheduler(min_span=10)
+	scheduler.add_job('a', 0, 100)
+	window = scheduler.next()
+	assert (window.job, window.after, window.before) == ('a', 0, 100)
+
+	keep, done = scheduler.advance(window, [{'created_utc': 5}, {'created_utc': 50}])
+	assert len(keep) == 2 and not done
+	assert window.cursor == 50
+	keep, done = scheduler.advance(window, [{'created_utc': 99}, {'created_utc': 100}])
+	assert keep == [{'created_utc': 99}] and done
+	assert scheduler.finish(window) == [window]
+	assert scheduler.next() is None
+
+def test_empty_page_finishes_window():
+	scheduler = WindowScheduler()
+	scheduler.add_job('a', 0, 100)
+	window = scheduler.next()
+	assert scheduler.advance(window, []) == ([], True)
+
+def test_steal_splits_running_window():
+	scheduler = WindowScheduler(min_span=10)
+	scheduler.add_job('a', 0, 1000)
+	window = scheduler.next()
+	scheduler.advance(window, [{'created_utc': 100}])
+
+	stolen = scheduler.next()
+	assert stolen.job == 'a'
+	# The windows stay disjoint and together cover the range
+	assert window.before == 550
+	assert (stolen.after, stolen.before) == (549, 1000)
+	keep, done = scheduler.advance(window, [{'created_utc': 549}, {'created_utc': 550}])
+	assert keep == [{'created_utc': 549}] and done
+
+def test_no_steal_below_min_span():
+	scheduler = WindowScheduler(min_span=100)
+	scheduler.add_job('a', 0, 1000)
+	scheduler.add_job('b', 0, 1000)
+	window = scheduler.next()
+	scheduler.advance(window, [{'created_utc': 850}])
+	# Pending jobs come before stealing
+	assert scheduler.next().job == 'b'
+	assert scheduler._steal() is None
+
+def test_unstarted_window_is_not_stolen():
+	scheduler = WindowScheduler(min_span=10)
+	scheduler.add_job('a', 0, 1000)
+	scheduler.next()
+	assert scheduler._steal() is None
+
+def test_finish_merges_windows_in_order():
+	scheduler = WindowScheduler(min_span=10)
+	scheduler.add_job('a', 0, 1000)
+	first = scheduler.next()
+	scheduler.advance(first, [{'created_utc': 1}])
+	second = scheduler.next()
+	scheduler.advance(second, [{'created_utc': 600}])
+	# Splits the first window, which has the most time left
+	third = scheduler.next()
+	assert (first.before, third.after, third.before, second.after) == (250, 249, 500, 499)
+
+	assert scheduler.finish(second) is None
+	assert scheduler.finish(first) is None
+	assert scheduler.finish(third) == [first, third, second]
+	assert scheduler.next() is None
+
+def test_workers_cover_whole_range():
+	rng = random.Random(0)
+	posts = {
+		'a': make_posts(rng, 0, 100000, 3000),
+		'b': make_posts(rng, 50000, 60000, 200),
+		'c': [],
+	}
+	scheduler = WindowScheduler(min_span=100)
+	scheduler.add_job('a', 0, 100000)
+	scheduler.add_job('b', 50000, 60000)
+	scheduler.add_job('c', 0, 100000)
+	merged = run_workers(scheduler, posts, num_workers=8, page_size=25)
+	assert merged == posts
@@ -0,0 +1,114 @@
+import os
+import threading
+
+import pytest
+
+from writer import CsvWriter
+
+
+def read(filename):
+	with open(filename, encoding='utf-8', newline='') as f:
+		return f.read()
+
+def test_rows_and_header_written_once(tmp_path):
+	filename = str(tmp_path / 'GME' / 'posts.csv')
+	writer = CsvWriter(fsync=False)
+	writer.write(filename, ['id', 'text'], [['1', 'a'], ['2', 'b|c']])
+	writer.write(filename, ['id', 'text'], [['3', 'd']])
+	writer.close()
+	writer.write(filename, ['id', 'text'], [['4', 'e']])
+	writer.close()
+	assert read(filename) == 'id|text\r\n1|a\r\n2|"b|c"\r\n3|d\r\n4|e\r\n'
+
+def test_callbacks_get_bytes_once_on_disk(tmp_path):
+	filename = str(tmp_path / 'posts.csv')
+	written = []
+	on_disk = threading.Event()
+
+	def callback(nbytes):
+		written.append((nbytes, os.path.getsize(filename)))
+		on_disk.set()
+
+	writer = CsvWriter(flush_bytes=2 ** 20, flush_interval=3600, fsync=False)
+	writer.write(filename, ['id'], [['1'], ['2']], callback)
+	writer.write(filename, ['id'], [], callback)
+	writer.write(filename, ['id'], [['3']], callback)
+	# Nothing is flushed before flush_bytes or flush_interval
+	assert not on_disk.wait(0.2)
+	writer.close()
+	assert written == [(10, 13), (0, 13), (3, 13)]
+
+def test_flush_at_flush_bytes(tmp_path):
+	filename = str(tmp_path / 'posts.csv')
+	flushed = threading.Event()
+	writer = CsvWriter(flush_bytes=10, flush_interval=3600, fsync=False)
+	writer.write(filename, ['id'], [['1']], lambda nbytes: flushed.set())
+	writer.write(filename, ['id'], [['12345']])
+	assert flushed.wait(5)
+	assert read(filename) == 'id\r\n1\r\n12345\r\n'
+	writer.close()
+
+def test_flush_at_flush_interval(tmp_path):
+	filename = str(tmp_path / 'posts.csv')
+	flushed = threading.Event()
+	writer = CsvWriter(flush_interval=0.1, fsync=False)
+	writer.write(filename, ['id'], [['1']], lambda nbytes: flushed.set())
+	assert flushed.wait(5)
+	assert read(filename) == 'id\r\n1\r\n'
+	writer.close()
+
+def test_files_closed_past_max_open(tmp_path):
+	filenames = [str(tmp_path / '{}.csv'.format(i)) for i in range(5)]
+	writer = CsvWriter(max_open=2, fsync=False)
+	for _ in range(2):
+		for i, filename in enumerate(filenames):
+			writer.write(filename, ['id'], [[str(i)]])
+	writer.close()
+	for i, filename in enumerate(filenames):
+		assert read(filename) == 'id\r\n{0}\r\n{0}\r\n'.format(i)
+
+def test_errors_are_raised_by_later_calls(tmp_path):
+	# A directory cannot be opened for appending
+	filename = str(tmp_path / 'posts.csv')
+	os.makedirs(filename)
+	writer = CsvWriter(queue_size=2, fsync=False)
+	writer.write(filename, ['id'], [['1']])
+	with pytest.raises(OSError):
+		writer.close()
+	with pytest.raises(OSError):
+		writer.write(str(tmp_path / 'other.csv'), ['id'], [['1']])
+	with pytest.raises(OSError):
+		writer.close()
+
+def test_failed_writer_does_not_block_writes(tmp_path):
+	filename = str(tmp_path / 'posts.csv')
+	os.makedirs(filename)
+	writer = CsvWriter(queue_size=1, fsync=False)
+	writer.write(filename, ['id'], [['1']])
+	errors = []
+
+	def write():
+		# Writes queued before the error is seen are dropped, not stuck on a full queue
+		for _ in range(100):
+			try:
+				writer.write(filename, ['id'], [['2']])
+			except OSError as e:
+				errors.append(e)
+				return
+
+	thread = threading.Thread(target=write)
+	thread.start()
+	thread.join(5)
+	assert not thread.is_alive()
+	assert len(errors) == 1
+	with pytest.raises(OSError):
+		writer.close()
+
+def test_callback_errors_are_raised(tmp_path):
+	def callback(nbytes):
+		raise ValueError('manifest is closed')
+
+	writer = CsvWriter(fsync=False)
+	writer.write(str(tmp_path / 'posts.csv'), ['id'], [['1']], callback)
+	with pytest.raises(ValueError):
+		writer.close()
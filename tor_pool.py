@@ -0,0 +1,204 @@
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+import aiohttp
+import requests
+from aiohttp_socks import ProxyConnector
+from stem import Signal
+from stem.control import Controller
+
+
+class Circuit:
+	"""A pooled session bound to its own tor circuit.
+
+	Tor isolates streams by SOCKS credentials, so each distinct username
+	gets its own circuit without a NEWNYM.
+	"""
+	def __init__(self, pool):
+		self.pool = pool
+		self.failures = 0
+		self.session = None
+		self.renew()
+
+	def renew(self):
+		"""Switch to a new circuit by switching credentials.
+		"""
+		if self.session is not None:
+			self.session.close()
+		self.username = 'circuit-{}'.format(secrets.token_hex(8))
+		self.password = secrets.token_hex(8)
+		self.session = requests.session()
+		proxy = self.pool.get_proxy_url(self.username, self.password)
+		if proxy is not None:
+			self.session.proxies = {
+				'http': proxy,
+				'https': proxy,
+			}
+
+	def get_connector(self, **kwargs):
+		"""Get an aiohttp connector on the same circuit.
+		"""
+		return self.pool.get_connector(self.username, self.password, **kwargs)
+
+class AsyncCircuit:
+	"""An aiohttp session on a circuit of its own, shared by a few coroutines.
+
+	A failing circuit is replaced as in `TorPool.fail`. The session on the
+	old circuit is closed once requests still running on it have timed out.
+	"""
+	def __init__(self, circuit, limit, timeout):
+		self.circuit = circuit
+		self.limit = limit
+		self.timeout = timeout
+		self.session = self._open()
+		self._retired = []
+
+	def _open(self):
+		return aiohttp.ClientSession(connector=self.circuit.get_connector(limit=self.limit), timeout=self.timeout)
+
+	async def fail(self, session):
+		"""Record a failed request on session, replacing the circuit if it keeps failing.
+		"""
+		# Requests sent before the last replacement failed on the old circuit
+		if session is not self.session:
+			return
+		if self.circuit.pool.fail(self.circuit):
+			self._retired.append((time.monotonic() + self.timeout.total, self.session))
+			self.session = self._open()
+		now = time.monotonic()
+		while len(self._retired) > 0 and self._retired[0][0] <= now:
+			await self._retired.pop(0)[1].close()
+
+	async def close(self):
+		for _, session in self._retired:
+			await session.close()
+		self._retired = []
+		await self.session.close()
+
+class TorPool:
+	"""Hand out sessions on isolated tor circuits.
+
+	A circuit is replaced only when it fails. Replacing one also sends
+	NEWNYM, at most once per `newnym_interval` seconds over one persistent
+	controller connection, so that new streams of other circuits move off
+	paths that may be blocked. `host=None` connects directly and
+	`control_port=None` disables the controller, e.g. to run against a
+	local SOCKS stand-in as in bench/tor_pool_check.py.
+	"""
+	def __init__(self, size, host='127.0.0.1', port=9050, control_port=9051, password=None,
+			newnym_interval=10, max_failures=1):
+		self.size = size
+		self.host = host
+		self.port = port
+		self.control_port = control_port
+		self.password = password if password is not None else os.environ.get('TOR_CONTROLLER_PW')
+		self.newnym_interval = newnym_interval
+		self.max_failures = max_failures
+		self.renewals = 0
+		self.newnyms = 0
+
+		self._circuits = None
+		self._free = queue.LifoQueue()
+		self._lock = threading.Lock()
+		self._controller = None
+		self._controller_lock = threading.Lock()
+		self._last_newnym = 0
+
+	def _init_circuits(self):
+		with self._lock:
+			if self._circuits is None:
+				self._circuits = [Circuit(self) for _ in range(self.size)]
+				for circuit in self._circuits:
+					self._free.put(circuit)
+
+	def get_proxy_url(self, username, password):
+		if self.host is None:
+			return None
+		return 'socks5://{}:{}@{}:{}'.format(username, password, self.host, self.port)
+
+	def get_connector(self, username, password, **kwargs):
+		if self.host is None:
+			return aiohttp.TCPConnector(**kwargs)
+		return ProxyConnector(
+			host=self.host,
+			port=self.port,
+			username=username,
+			password=password,
+			rdns=True,
+			**kwargs)
+
+	def acquire(self):
+		"""Take a circuit from the pool, waiting until one is free.
+		"""
+		self._init_circuits()
+		return self._free.get()
+
+	def release(self, circuit):
+		"""Return a circuit to the pool.
+		"""
+		self._free.put(circuit)
+
+	def fail(self, circuit):
+		"""Record a failed request, replacing the circuit if it keeps failing.
+
+		Returns whether the circuit was replaced.
+		"""
+		circuit.failures += 1
+		if circuit.failures < self.max_failures:
+			return False
+		circuit.failures = 0
+		circuit.renew()
+		self.renewals += 1
+		try:
+			self.newnym()
+		except Exception as e:
+			print('Tor NEWNYM failed: {}'.format(e))
+		return True
+
+	@contextmanager
+	def circuit(self):
+		circuit = self.acquire()
+		try:
+			yield circuit
+		finally:
+			self.release(circuit)
+
+	def get_circuits(self, n):
+		"""Get n circuits for long-lived use, e.g. one per aiohttp session.
+		"""
+		return [Circuit(self) for _ in range(n)]
+
+	def _get_controller(self):
+		if self._controller is None or not self._controller.is_alive():
+			self._controller = Controller.from_port(port=self.control_port)
+			self._controller.authenticate(password=self.password)
+		return self._controller
+
+	def newnym(self):
+		"""Ask tor for new circuits, unless it was asked within `newnym_interval`.
+		"""
+		if self.control_port is None:
+			return False
+		with self._controller_lock:
+			if time.time() - self._last_newnym < self.newnym_interval:
+				return False
+			# Throttle failed attempts too, so an unreachable controller is not retried on every failure
+			self._last_newnym = time.time()
+			try:
+				controller = self._get_controller()
+				controller.signal(Signal.NEWNYM)
+			except Exception:
+				self._controller = None
+				raise
+			self.newnyms += 1
+			return True
+
+	def close(self):
+		with self._controller_lock:
+			if self._controller is not None:
+				self._controller.close()
+				self._controller = None
@@ -85,3 +85,6 @@ class Config:
     Bearer_token: str = None
     Guest_token: str = None
     deleted: list = None
+    Windows: int = 1
+    Window: Optional[int] = None
+    Search_error: Optional[str] = None
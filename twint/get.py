@@ -6,8 +6,11 @@ import socket
 import aiohttp
 from fake_useragent import UserAgent
 import asyncio
+import atexit
 import concurrent.futures
 import random
+import threading
+import time
 from json import loads, dumps
 from aiohttp_socks import ProxyConnector, ProxyType
 from urllib.parse import quote
@@ -20,6 +23,23 @@ import logging as logme
 
 httpproxy = None
 
+# Pooled sessions keep connections, and so SOCKS and TLS handshakes, alive between requests
+CONNECTOR_OPTIONS = {
+    'limit': 100,
+    'keepalive_timeout': 60,
+    'ttl_dns_cache': 300,
+}
+_sessions = {}
+# Requests running on each session, and sessions to close once they finish
+_in_flight = {}
+_retired = set()
+# Searches of several threads share the pooled state
+_sessions_lock = threading.Lock()
+# Sends NEWNYM for twint, e.g. a throttled one shared with other Tor users; None opens a control connection each time
+newnym = None
+# Called with the url, the status or None on a connection error, and the seconds of each request
+report = None
+
 user_agent_list = [
     # 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)'
     # ' Chrome/60.0.3112.113 Safari/537.36',
@@ -65,7 +85,7 @@ def dict_to_url(dct):
     return quote(dumps(dct))
 
 
-def get_connector(config):
+def get_connector(config, **kwargs):
     logme.debug(__name__ + ':get_connector')
     _connector = None
     if config.Proxy_host:
@@ -73,7 +93,8 @@ def get_connector(config):
             _connector = ProxyConnector(
                 host='127.0.0.1',
                 port=9050,
-                rdns=True)
+                rdns=True,
+                **kwargs)
         elif config.Proxy_port and config.Proxy_type:
             if config.Proxy_type.lower() == "socks5":
                 _type = ProxyType.SOCKS5
@@ -91,7 +112,8 @@ def get_connector(config):
                 proxy_type=_type,
                 host=config.Proxy_host,
                 port=config.Proxy_port,
-                rdns=True)
+                rdns=True,
+                **kwargs)
         else:
             logme.critical(__name__ + ':get_connector:proxy-port-type-error')
             print("Error: Please specify --proxy-host, --proxy-port, and --proxy-type")
@@ -105,9 +127,79 @@ def get_connector(config):
     return _connector
 
 
+def proxy_key(config):
+    """Get the key of the proxy of config, None when going direct.
+    """
+    if config is None or not config.Proxy_host:
+        return None
+    return config.Proxy_host.lower(), config.Proxy_port, config.Proxy_type
+
+
+def session_key(config):
+    """Get the key of pooled state of the running event loop for the proxy of config.
+    """
+    return asyncio.get_event_loop(), proxy_key(config)
+
+
+def get_session(config=None):
+    """Get the pooled session of the running event loop for the proxy of config, opening it on first use.
+
+    Requests without config go direct. Sessions are kept for later runs on the same event loop.
+    """
+    logme.debug(__name__ + ':get_session')
+    key = session_key(config)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None or session.closed:
+            # Sessions of closed event loops cannot be used again
+            for stale in [k for k in _sessions if k[0].is_closed()]:
+                del _sessions[stale]
+            _connector = get_connector(config, **CONNECTOR_OPTIONS) if config is not None else None
+            if _connector is None:
+                _connector = aiohttp.TCPConnector(**CONNECTOR_OPTIONS)
+            session = aiohttp.ClientSession(connector=_connector)
+            _sessions[key] = session
+    return session
+
+
+def reset_session(config=None):
+    """Drop the pooled session for the proxy of config, so that the next request opens a new one.
+
+    Requests still running on the old session finish on it before it is closed.
+    """
+    logme.debug(__name__ + ':reset_session')
+    with _sessions_lock:
+        session = _sessions.pop(session_key(config), None)
+        if session is None:
+            return
+        if _in_flight.get(session, 0) > 0:
+            _retired.add(session)
+            return
+    asyncio.ensure_future(session.close())
+
+
+async def close_sessions():
+    """Close the pooled sessions of the running event loop.
+    """
+    logme.debug(__name__ + ':close_sessions')
+    loop = asyncio.get_event_loop()
+    with _sessions_lock:
+        sessions = [_sessions.pop(k) for k in list(_sessions) if k[0] is loop]
+    for session in sessions:
+        await session.close()
+
+
+@atexit.register
+def _close_idle_sessions():
+    with _sessions_lock:
+        loops = set(k[0] for k in _sessions)
+    for loop in loops:
+        if not loop.is_closed() and not loop.is_running():
+            loop.run_until_complete(close_sessions())
+
+
 async def RequestUrl(config, init):
     logme.debug(__name__ + ':RequestUrl')
-    _connector = get_connector(config)
     _serialQuery = ""
     params = []
     _url = ""
@@ -132,7 +224,7 @@ async def RequestUrl(config, init):
             _url = await url.Favorites(config.Username, init)
         _serialQuery = _url
 
-    response = await Request(_url, params=params, connector=_connector, headers=_headers)
+    response = await Request(_url, params=params, headers=_headers, config=config)
 
     if config.Debug:
         print(_serialQuery, file=open("twint-request_urls.log", "a", encoding="utf-8"))
@@ -140,35 +232,70 @@ async def RequestUrl(config, init):
     return response
 
 
+def NewTorIdentity(config):
+    """Ask Tor for new circuits, through `newnym` when the caller set it.
+    """
+    if newnym is not None:
+        newnym()
+        return
+    tor_c = socket.create_connection(('127.0.0.1', config.Tor_control_port))
+    tor_c.send('AUTHENTICATE "{}"\r\nSIGNAL NEWNYM\r\n'.format(config.Tor_control_password).encode())
+    response = tor_c.recv(1024)
+    if response != b'250 OK\r\n250 OK\r\n':
+        sys.stderr.write('Unexpected response from Tor control port: {}\n'.format(response))
+        logme.critical(__name__ + ':ForceNewTorIdentity:unexpectedResponse')
+
+
 def ForceNewTorIdentity(config):
     logme.debug(__name__ + ':ForceNewTorIdentity')
     try:
-        tor_c = socket.create_connection(('127.0.0.1', config.Tor_control_port))
-        tor_c.send('AUTHENTICATE "{}"\r\nSIGNAL NEWNYM\r\n'.format(config.Tor_control_password).encode())
-        response = tor_c.recv(1024)
-        if response != b'250 OK\r\n250 OK\r\n':
-            sys.stderr.write('Unexpected response from Tor control port: {}\n'.format(response))
-            logme.critical(__name__ + ':ForceNewTorIdentity:unexpectedResponse')
+        NewTorIdentity(config)
+        # Kept-alive connections would stay on the old circuit
+        reset_session(config)
     except Exception as e:
         logme.debug(__name__ + ':ForceNewTorIdentity:errorConnectingTor')
         sys.stderr.write('Error connecting to Tor control port: {}\n'.format(repr(e)))
         sys.stderr.write('If you want to rotate Tor ports automatically - enable Tor control port\n')
 
 
-async def Request(_url, connector=None, params=None, headers=None):
+async def Request(_url, connector=None, params=None, headers=None, config=None):
     logme.debug(__name__ + ':Request:Connector')
-    async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
-        return await Response(session, _url, params)
-
-
-async def Response(session, _url, params=None):
+    if connector is not None:
+        # A connector of its own gets a session of its own
+        async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+            return await Response(session, _url, params)
+    session = get_session(config)
+    with _sessions_lock:
+        _in_flight[session] = _in_flight.get(session, 0) + 1
+    try:
+        return await Response(session, _url, params, headers)
+    finally:
+        with _sessions_lock:
+            _in_flight[session] -= 1
+            retired = _in_flight[session] == 0 and session in _retired
+            if _in_flight[session] == 0:
+                del _in_flight[session]
+                _retired.discard(session)
+        if retired:
+            await session.close()
+
+
+async def Response(session, _url, params=None, headers=None):
     logme.debug(__name__ + ':Response')
-    with timeout(120):
-        async with session.get(_url, ssl=True, params=params, proxy=httpproxy) as response:
-            resp = await response.text()
-            if response.status == 429:  # 429 implies Too many requests i.e. Rate Limit Exceeded
-                raise TokenExpiryException(loads(resp)['errors'][0]['message'])
-            return resp
+    start = time.time()
+    try:
+        async with timeout(120):
+            async with session.get(_url, ssl=True, params=params, proxy=httpproxy, headers=headers) as response:
+                resp = await response.text()
+    except Exception:
+        if report is not None:
+            report(_url, None, time.time() - start)
+        raise
+    if report is not None:
+        report(_url, response.status, time.time() - start)
+    if response.status == 429:  # 429 implies Too many requests i.e. Rate Limit Exceeded
+        raise TokenExpiryException(loads(resp)['errors'][0]['message'])
+    return resp
 
 
 async def RandomUserAgent(wa=None):
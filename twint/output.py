@@ -129,6 +129,8 @@ def _output(obj, output, config, **extra):
 async def checkData(tweet, config, conn):
     logme.debug(__name__ + ':checkData')
     tweet = Tweet(tweet, config)
+    if config.Window is not None:
+        tweet.window = config.Window
     if not tweet.datestamp:
         logme.critical(__name__ + ':checkData:hiddenTweetFound')
         print("[x] Hidden tweet found, account suspended due to violation of TOS")
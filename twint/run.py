@@ -1,10 +1,11 @@
-import sys, os, datetime
-from asyncio import get_event_loop, TimeoutError, ensure_future, new_event_loop, set_event_loop
+import sys, os, datetime, copy, shutil, tempfile
+from asyncio import gather, get_event_loop, Semaphore, TimeoutError, ensure_future, new_event_loop, set_event_loop
+from functools import partial
 
 from . import datelock, feed, get, output, verbose, storage
 from .token import TokenExpiryException
 from . import token
-from .storage import db
+from .storage import db, write
 from .feed import NoMoreTweetsException
 
 import logging as logme
@@ -16,7 +17,7 @@ bearer = 'Bearer AAAAAAAAAAAAAAAAAAAAANRILgAAAAAAnNwIzUejRCOuH5E6I8xnZz4puTs' \
 
 
 class Twint:
-	def __init__(self, config):
+	def __init__(self, config, token=None, conn=None):
 		logme.debug(__name__ + ':Twint:__init__')
 		if config.Resume is not None and (config.TwitterSearch or config.Followers or config.Following):
 			logme.debug(__name__ + ':Twint:__init__:Resume')
@@ -25,16 +26,18 @@ class Twint:
 			self.init = -1
 
 		config.deleted = []
+		# Set if the feed gives up on errors, so callers know the search stopped short
+		config.Search_error = None
 		self.feed: list = [-1]
 		self.count = 0
 		self.user_agent = ""
 		self.config = config
 		self.config.Bearer_token = bearer
-		# TODO might have to make some adjustments for it to work with multi-treading
-		# USAGE : to get a new guest token simply do `self.token.refresh()`
-		self.token = token.Token(config)
-		self.token.refresh()
-		self.conn = db.Conn(config.Database)
+		# Guest tokens come from a pool shared by the searches of the event loop, see `run`
+		self.token = token
+		if conn is None:
+			conn = db.Conn(config.Database)
+		self.conn = conn
 		self.d = datelock.Set(self.config.Until, self.config.Since)
 		verbose.Elastic(config.Elasticsearch)
 
@@ -62,7 +65,8 @@ class Twint:
 				response = await get.RequestUrl(self.config, self.init)
 			except TokenExpiryException as e:
 				logme.debug(__name__ + 'Twint:Feed:' + str(e))
-				self.token.refresh()
+				self.token.expire(self.config.Guest_token)
+				self.config.Guest_token = await self.token.get()
 				response = await get.RequestUrl(self.config, self.init)
 
 			if self.config.Debug:
@@ -107,6 +111,7 @@ class Twint:
 						sys.stderr.write(
 							"Info: What is it? See https://stem.torproject.org/faq.html#can-i-interact-with-tors"
 							"-controller-interface-directly\r\n")
+						self.config.Search_error = repr(e)
 						break
 					else:
 						get.ForceNewTorIdentity(self.config)
@@ -114,6 +119,7 @@ class Twint:
 				else:
 					logme.critical(__name__ + ':Twint:Feed:' + str(e))
 					print(str(e))
+					self.config.Search_error = repr(e)
 					break
 			except Exception as e:
 				if self.config.Profile or self.config.Favorites:
@@ -141,6 +147,7 @@ class Twint:
 				sys.stderr.write(
 					"[!] if you get this error but you know for sure that more tweets exist, please open an issue and "
 					"we will investigate it!")
+				self.config.Search_error = repr(e)
 				break
 		if self.config.Resume:
 			print(self.init, file=open(self.config.Resume, "a", encoding="utf-8"))
@@ -235,6 +242,10 @@ class Twint:
 		await task
 
 	async def run(self):
+		if self.token is None:
+			self.token = token.get_pool(self.config)
+		self.config.Guest_token = await self.token.get()
+
 		if self.config.TwitterSearch:
 			self.user_agent = await get.RandomUserAgent(wa=True)
 		else:
@@ -311,8 +322,7 @@ class Twint:
 			raise
 
 
-def run(config, callback=None):
-	logme.debug(__name__ + ':run')
+def _event_loop():
 	try:
 		get_event_loop()
 	except RuntimeError as e:
@@ -325,8 +335,155 @@ def run(config, callback=None):
 		logme.exception(
 			__name__ + ':run:Unexpected exception occurred while attempting to get or create a new event loop.')
 		raise
+	return get_event_loop()
 
-	get_event_loop().run_until_complete(Twint(config).main(callback))
+
+def run(config, callback=None):
+	logme.debug(__name__ + ':run')
+	if config.TwitterSearch and config.Windows > 1:
+		logme.debug(__name__ + ':run:windows')
+		result, = _event_loop().run_until_complete(
+			_run_many([config], config.Windows, (lambda config, task: callback(task)) if callback else None))
+		if isinstance(result, BaseException):
+			raise result
+		return
+	_event_loop().run_until_complete(Twint(config).main(callback))
+
+
+def _parse_date(date):
+	return datetime.datetime.strptime(datelock.convertToDateTime(date), "%Y-%m-%d %H:%M:%S")
+
+
+def split_windows(config, windows):
+	"""Get configs of a search split into windows of equal time between Since and Until, newest first.
+
+	Window outputs go to a temporary directory next to the output of
+	config, also returned, or None if config has no output.
+	"""
+	logme.debug(__name__ + ':split_windows')
+	since = _parse_date(config.Since if config.Since else "2006-03-21 00:00:00")
+	until = _parse_date(config.Until) if config.Until else datetime.datetime.now().replace(microsecond=0)
+	span = (until - since) / windows
+	output_dir = None
+	if config.Output:
+		# Csv and json outputs without an extension are directories, see write.addExt
+		is_dir = (config.Store_csv or config.Store_json) and len(config.Output.split('.')) == 1
+		parent = config.Output if is_dir else os.path.dirname(config.Output)
+		write.createDirIfMissing(parent or '.')
+		output_dir = tempfile.mkdtemp(prefix='.windows', dir=parent or '.')
+
+	configs = []
+	for i in range(windows):
+		c = copy.copy(config)
+		c.Windows = 1
+		c.Window = i
+		c.Since = (until - span * (i + 1)).strftime("%Y-%m-%d %H:%M:%S") if i < windows - 1 else since.strftime("%Y-%m-%d %H:%M:%S")
+		c.Until = (until - span * i).strftime("%Y-%m-%d %H:%M:%S")
+		c.Resume = None
+		c.Pandas_clean = False
+		if output_dir is not None:
+			c.Output = os.path.join(output_dir, str(i))
+		configs.append(c)
+	return configs, output_dir
+
+
+def _merge_windows(config, configs):
+	"""Append window outputs to the output of config, newest window first as a serial search would.
+	"""
+	logme.debug(__name__ + ':_merge_windows')
+	if config.Store_csv or config.Store_json:
+		_ext = "csv" if config.Store_csv else "json"
+		target = write.addExt(config.Output, "tweet", _ext)
+		sources = [write.addExt(c.Output, "tweet", _ext) for c in configs]
+	else:
+		target = config.Output
+		sources = [c.Output for c in configs]
+
+	# Keep one csv header, the first one if the output is new
+	header = config.Store_csv and not os.path.exists(target)
+	with open(target, "ab") as f:
+		for source in sources:
+			if not os.path.exists(source):
+				continue
+			with open(source, "rb") as window_file:
+				if config.Store_csv:
+					line = window_file.readline()
+					if header:
+						f.write(line)
+						header = False
+				shutil.copyfileobj(window_file, f)
+
+
+async def _run_many(configs, concurrency, callback):
+	logme.debug(__name__ + ':_run_many')
+	if len(configs) == 0:
+		return []
+	# One guest token pool, one pooled session and one connection per database for all searches
+	_token = token.get_pool(configs[0])
+	conns = {}
+	semaphore = Semaphore(concurrency)
+
+	async def search_one(config):
+		async with semaphore:
+			if config.Database not in conns:
+				conns[config.Database] = db.Conn(config.Database)
+			twint = Twint(config, token=_token, conn=conns[config.Database])
+			await twint.main()
+			return twint.count
+
+	async def search(config):
+		if not config.Windows > 1:
+			return await search_one(config)
+		if config.Pandas_clean:
+			storage.panda.clean()
+		# Windows run as searches of their own, merged once all are done
+		window_configs, output_dir = split_windows(config, config.Windows)
+		tasks = [ensure_future(search_one(c)) for c in window_configs]
+		try:
+			counts = await gather(*tasks)
+			errors = [c.Search_error for c in window_configs if c.Search_error is not None]
+			config.Search_error = errors[0] if len(errors) > 0 else None
+			# A window that stopped short would leave a gap, so its search is discarded like a failed one
+			if output_dir is not None and config.Search_error is None:
+				_merge_windows(config, window_configs)
+		finally:
+			# Stop the other windows of a failed search before removing their outputs
+			for task in tasks:
+				task.cancel()
+			await gather(*tasks, return_exceptions=True)
+			if output_dir is not None:
+				shutil.rmtree(output_dir, ignore_errors=True)
+		return sum(counts)
+
+	async def search_task(config):
+		task = ensure_future(search(config))
+		if callback:
+			task.add_done_callback(partial(callback, config))
+		return await task
+
+	return await gather(*[search_task(config) for config in configs], return_exceptions=True)
+
+
+def SearchMany(configs, concurrency=16, callback=None):
+	"""Run many searches as tasks of one event loop, at most `concurrency` at a time.
+
+	Searches share a guest token pool, the HTTP connection pool and database
+	connections. A config with Windows > 1 is split into that many time
+	windows searched concurrently, see `split_windows`.
+	callback(config, task) is called as each search is done.
+	Returns the number of tweets of each search, or the exception it raised.
+	"""
+	logme.debug(__name__ + ':SearchMany')
+	for config in configs:
+		config.TwitterSearch = True
+		config.Favorites = False
+		config.Following = False
+		config.Followers = False
+		config.Profile = False
+	results = _event_loop().run_until_complete(_run_many(configs, concurrency, callback))
+	if any(config.Pandas_au for config in configs):
+		storage.panda._autoget("tweet")
+	return results
 
 
 def Favorites(config):
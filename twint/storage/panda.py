@@ -108,6 +108,8 @@ def update(object, config):
             "trans_src": Tweet.trans_src,
             "trans_dest": Tweet.trans_dest
             }
+        if config.Window is not None:
+            _data["window"] = config.Window
         _object_blocks[_type].append(_data)
     elif _type == "user":
         user = object
@@ -1,31 +1,10 @@
+import aiohttp
+import asyncio
 import logging as logme
-import os
 import re
-import requests
+import threading
 import time
 
-from stem import Signal
-from stem.control import Controller
-from stem.util.log import get_logger
-logger = get_logger()
-logger.propagate = False
-
-
-def get_tor_session():
-	session = requests.session()
-	session.proxies = {
-		'http': 'socks5://127.0.0.1:9050',
-		'https': 'socks5://127.0.0.1:9050',
-	}
-	return session
-
-
-def renew_connection():
-	with Controller.from_port(port=9051) as c:
-		password = os.environ.get('TOR_CONTROLLER_PW')
-		c.authenticate(password=password)
-		c.signal(Signal.NEWNYM)
-
 
 class TokenExpiryException(Exception):
 	def __init__(self, msg):
@@ -37,67 +16,138 @@ class RefreshTokenException(Exception):
 		super().__init__(msg)
 
 
-class Token:
-	def __init__(self, config):
-		self.renew()
+class TokenPool:
+	"""Guest tokens shared by the searches of all event loops, fetched in the background.
+
+	`get` hands out the least used live token, so requests spread over
+	`size` tokens. A token that got a 429 is dropped with `expire` and
+	replaced by a new one, without a Tor rotation unless fetching fails.
+	Tokens are fetched on a loop of the pool's own, so that fills outlive
+	the loops of the searches that started them.
+	"""
+	url = 'https://twitter.com'
+	user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:78.0) Gecko/20100101 Firefox/78.0'
+
+	def __init__(self, config, size=4, ttl=10800, retries=10):
 		self.config = config
-		self._retries = 100
-		self._timeout = 100
-		self.url = 'https://twitter.com'
-
-	def renew(self):
-		renew_connection()
-		self._session = get_tor_session()
-		self._session.headers.update({'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:78.0) Gecko/20100101 Firefox/78.0'})
-
-	def _request(self):
-		for attempt in range(self._retries + 1):
-			# The request is newly prepared on each retry because of potential cookie updates.
-			req = self._session.prepare_request(requests.Request('GET', self.url))
-			logme.debug(f'Retrieving {req.url}')
+		self.size = size
+		self.ttl = ttl
+		self.retries = retries
+		# Guest token to [expiry, uses]
+		self.tokens = {}
+		self.fetched = 0
+		self.expired = 0
+		self._lock = threading.Lock()
+		self._loop = None
+		self._fill_future = None
+
+	async def get(self):
+		"""Get a live guest token, waiting for one only if the pool is empty.
+		"""
+		while True:
+			with self._lock:
+				now = time.time()
+				for guest_token in [t for t, (expiry, _) in self.tokens.items() if expiry <= now]:
+					del self.tokens[guest_token]
+				if len(self.tokens) < self.size:
+					self._fill()
+				if len(self.tokens) > 0:
+					guest_token = min(self.tokens, key=lambda t: self.tokens[t][1])
+					self.tokens[guest_token][1] += 1
+					return guest_token
+				fill_future = self._fill_future
+			# Raises if fetching failed
+			await asyncio.shield(asyncio.wrap_future(fill_future))
+
+	def expire(self, guest_token):
+		"""Drop a rate limited guest token and fetch a replacement.
+		"""
+		with self._lock:
+			if self.tokens.pop(guest_token, None) is not None:
+				logme.debug(__name__ + ':TokenPool:expire')
+				self.expired += 1
+			self._fill()
+
+	def _fill(self):
+		if self._fill_future is None or self._fill_future.done():
+			if self._loop is None:
+				self._loop = asyncio.new_event_loop()
+				threading.Thread(target=self._loop.run_forever, daemon=True).start()
+			self._fill_future = asyncio.run_coroutine_threadsafe(self._fill_async(), self._loop)
+			self._fill_future.add_done_callback(self._fill_done)
+
+	def _fill_done(self, future):
+		# Nobody awaits a fill started by expire while tokens are left
+		if not future.cancelled() and future.exception() is not None:
+			logme.warning(__name__ + ':TokenPool:_fill:' + str(future.exception()))
+
+	async def _fill_async(self):
+		with self._lock:
+			missing = self.size - len(self.tokens)
+		results = await asyncio.gather(*[self._fetch() for _ in range(missing)], return_exceptions=True)
+		with self._lock:
+			for result in results:
+				if isinstance(result, BaseException):
+					if len(self.tokens) == 0:
+						raise result
+					continue
+				guest_token, ttl = result
+				self.tokens[guest_token] = [time.time() + ttl, 0]
+				self.fetched += 1
+
+	async def _fetch(self):
+		# get imports this module
+		from . import get
+		for attempt in range(self.retries + 1):
 			try:
-				r = self._session.send(req, allow_redirects=True, timeout=self._timeout)
-			except requests.exceptions.RequestException as exc:
-				if attempt < self._retries:
-					retrying = ', retrying'
-					level = logme.WARNING
-				else:
-					retrying = ''
-					level = logme.ERROR
-				logme.log(level, f'Error retrieving {req.url}: {exc!r}{retrying}')
-			else:
-				success, msg = (True, None)
-				msg = f': {msg}' if msg else ''
-
-				if success:
-					logme.debug(f'{req.url} retrieved successfully{msg}')
-					return r
-			if attempt < self._retries:
-				# TODO : might wanna tweak this back-off timer
-				sleep_time = 2.0 * 2 ** attempt
-				logme.info(f'Waiting {sleep_time:.0f} seconds')
-				time.sleep(sleep_time)
-		else:
-			msg = f'{self._retries + 1} requests to {self.url} failed, giving up.'
-			logme.fatal(msg)
-			self.config.Guest_token = None
-			raise RefreshTokenException(msg)
-
-	def refresh(self):
-		logme.debug('Retrieving guest token')
-		res = self._request()
-		match = re.search(r'\("gt=(\d+);', res.text)
-
-		while not match:
-			self.renew()
-			time.sleep(10)
-			res = self._request()
-			match = re.search(r'\("gt=(\d+);', res.text)
-
-		if match:
-			logme.debug('Found guest token in HTML')
-			self.config.Guest_token = str(match.group(1))
-		else:
-			self.config.Guest_token = None
-			raise RefreshTokenException('Could not find the Guest token in HTML')
-
+				# A session of its own, so that renewing the circuit leaves running searches alone
+				connector = get.get_connector(self.config)
+				if connector is None:
+					connector = aiohttp.TCPConnector()
+				html = await get.Request(self.url, connector=connector, headers={'User-Agent': self.user_agent})
+				match = re.search(r'\("gt=(\d+);', html)
+				if match:
+					logme.debug(__name__ + ':TokenPool:_fetch:found')
+					age = re.search(r'\("gt=\d+; Max-Age=(\d+)', html)
+					# Stop handing out a token a little before it expires
+					ttl = min(self.ttl, int(age.group(1)) if age else self.ttl) * 0.9
+					return match.group(1), ttl
+				logme.debug(__name__ + ':TokenPool:_fetch:noToken')
+			except Exception as e:
+				logme.warning(__name__ + ':TokenPool:_fetch:' + str(e))
+			if attempt < self.retries:
+				# Try another circuit after a few failures
+				if attempt % 3 == 2 and self.config.Proxy_host and self.config.Proxy_host.lower() == 'tor':
+					try:
+						await asyncio.get_event_loop().run_in_executor(None, get.NewTorIdentity, self.config)
+					except Exception as e:
+						logme.warning(__name__ + ':TokenPool:_fetch:' + str(e))
+				await asyncio.sleep(min(2.0 * 2 ** attempt, 60))
+		msg = f'{self.retries + 1} requests to {self.url} failed, giving up.'
+		logme.fatal(msg)
+		raise RefreshTokenException(msg)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_counts():
+	"""Get the numbers of guest tokens fetched and expired by all pools.
+	"""
+	with _pools_lock:
+		pools = list(_pools.values())
+	return sum(pool.fetched for pool in pools), sum(pool.expired for pool in pools)
+
+
+def get_pool(config):
+	"""Get the token pool for the proxy of config, shared by all event loops.
+	"""
+	from . import get
+	key = get.proxy_key(config)
+	with _pools_lock:
+		pool = _pools.get(key)
+		if pool is None:
+			pool = TokenPool(config)
+			_pools[key] = pool
+	return pool
@@ -0,0 +1,158 @@
+import csv
+import io
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+
+class CsvFile:
+	"""An open csv file and its rows not yet written.
+	"""
+	def __init__(self, filename):
+		self.filename = filename
+		self.header = not os.path.exists(filename)
+		self.f = open(filename, 'ab')
+		self.chunks = []
+		self.size = 0
+		self.callbacks = []
+
+class CsvWriter:
+	"""Append rows to csv files from one thread fed by a bounded queue.
+
+	Recently used files stay open, up to `max_open`. Rows of a file are
+	buffered and written at once when they reach `flush_bytes`, and all
+	files are flushed at least every `flush_interval` seconds. The
+	callback of a write gets the number of bytes it took once they are
+	on disk, so that the manifest never gets ahead of the data.
+	"""
+	def __init__(self, delimiter='|', max_open=64, queue_size=256, flush_bytes=2 ** 20, flush_interval=5.0,
+			fsync=True):
+		self.delimiter = delimiter
+		self.max_open = max_open
+		self.flush_bytes = flush_bytes
+		self.flush_interval = flush_interval
+		self.fsync = fsync
+
+		self._queue = queue.Queue(maxsize=queue_size)
+		self._files = OrderedDict()
+		self._dirs = set()
+		self._thread = None
+		self._lock = threading.Lock()
+		self._error = None
+
+	def write(self, filename, fieldnames, rows, callback=None):
+		"""Queue rows to append to filename, writing the header if the file is new.
+		"""
+		self._raise_error()
+		with self._lock:
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run, daemon=True)
+				self._thread.start()
+		self._queue.put((filename, fieldnames, rows, callback))
+
+	def qsize(self):
+		return self._queue.qsize()
+
+	def close(self):
+		"""Write out all queued rows and close all files.
+		"""
+		with self._lock:
+			thread = self._thread
+			self._thread = None
+		if thread is not None:
+			self._queue.put(None)
+			thread.join()
+		self._raise_error()
+
+	def _raise_error(self):
+		# Rows queued after a failed write are dropped, so every later call raises
+		if self._error is not None:
+			raise self._error
+
+	def _run(self):
+		last_flush = time.monotonic()
+		try:
+			while True:
+				timeout = max(0, self.flush_interval - (time.monotonic() - last_flush))
+				try:
+					item = self._queue.get(timeout=timeout)
+				except queue.Empty:
+					item = False
+				if item is None:
+					break
+				if item:
+					self._append(*item)
+				if time.monotonic() - last_flush >= self.flush_interval:
+					for csv_file in list(self._files.values()):
+						self._flush(csv_file)
+					last_flush = time.monotonic()
+		except Exception as e:
+			self._error = e
+			# Keep taking items so writers do not block on a full queue
+			while self._queue.get() is not None:
+				pass
+		finally:
+			for filename in list(self._files):
+				try:
+					self._close_file(filename)
+				except Exception as e:
+					# Raised by close, like errors of earlier writes
+					if self._error is None:
+						self._error = e
+
+	def _open(self, filename):
+		csv_file = self._files.get(filename)
+		if csv_file is not None:
+			self._files.move_to_end(filename)
+			return csv_file
+
+		output_dir = os.path.dirname(filename)
+		if output_dir and output_dir not in self._dirs:
+			os.makedirs(output_dir, exist_ok=True)
+			self._dirs.add(output_dir)
+
+		if len(self._files) >= self.max_open:
+			self._close_file(next(iter(self._files)))
+		csv_file = CsvFile(filename)
+		self._files[filename] = csv_file
+		return csv_file
+
+	def _append(self, filename, fieldnames, rows, callback):
+		csv_file = self._open(filename)
+		buf = io.StringIO()
+		writer = csv.writer(buf, delimiter=self.delimiter)
+		if csv_file.header:
+			writer.writerow(fieldnames)
+			csv_file.header = False
+		writer.writerows(rows)
+		chunk = buf.getvalue().encode('utf-8')
+
+		csv_file.chunks.append(chunk)
+		csv_file.size += len(chunk)
+		if callback is not None:
+			csv_file.callbacks.append((callback, len(chunk)))
+		if csv_file.size >= self.flush_bytes:
+			self._flush(csv_file)
+
+	def _flush(self, csv_file):
+		if len(csv_file.chunks) == 0:
+			return
+		csv_file.f.write(b''.join(csv_file.chunks))
+		csv_file.f.flush()
+		if self.fsync:
+			os.fsync(csv_file.f.fileno())
+		callbacks = csv_file.callbacks
+		csv_file.chunks = []
+		csv_file.size = 0
+		csv_file.callbacks = []
+		for callback, nbytes in callbacks:
+			callback(nbytes)
+
+	def _close_file(self, filename):
+		csv_file = self._files.pop(filename)
+		try:
+			self._flush(csv_file)
+		finally:
+			csv_file.f.close()